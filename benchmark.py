@@ -0,0 +1,432 @@
+# Offline benchmark / load test for the review pipeline.
+#
+# Runs the real bot (handlers, scheduler, browser pool and Selenium flow) against two
+# local stand-ins, so nothing touches chess.com or Telegram:
+#   - a fake chess.com serving /login, the /home redirect and the review page
+#   - a fake Telegram Bot API that feeds synthetic updates through getUpdates and
+#     timestamps every reply the bot sends back
+#
+# Usage:
+#   python benchmark.py --users 20 --rate 0.5 --requests 60 --save run.json
+#   python benchmark.py --users 20 --rate 0.5 --requests 60 --baseline run.json
+#
+# Bot settings (BROWSER_POOL_SIZE, BROWSER_MODE, ...) are read from the environment
+# as usual, so the same command can be repeated with different settings and compared.
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import statistics
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
+)
+logger = logging.getLogger("benchmark")
+
+BENCH_TOKEN = "123456:BENCHMARK"
+SESSION_COOKIE = "PHPSESSID=bench-session"
+
+
+# --- Fake chess.com ---
+
+LOGIN_PAGE = b"""<!doctype html><html><body>
+<form method="post" action="/login">
+  <input id="login-username" name="username">
+  <input id="login-password" name="password" type="password">
+  <button id="login" type="submit">Log In</button>
+</form></body></html>"""
+
+HOME_PAGE = b"<!doctype html><html><body><h1>Home</h1></body></html>"
+
+# The review button appears after a delay, like the real page finishing its scripts.
+REVIEW_PAGE = """<!doctype html><html><body><div id="board">game {game_id}</div>
+<script>setTimeout(function () {{
+  var span = document.createElement("span"); span.textContent = "Start Review";
+  var button = document.createElement("button"); button.appendChild(span);
+  document.body.appendChild(button);
+}}, {delay_ms});</script></body></html>"""
+
+class FakeChessHandler(BaseHTTPRequestHandler):
+    page_delay_ms = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _logged_in(self):
+        return SESSION_COOKIE in self.headers.get("Cookie", "")
+
+    def _send(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/login":
+            self._send(200, LOGIN_PAGE)
+        elif path == "/home":
+            if self._logged_in():
+                self._send(200, HOME_PAGE)
+            else:
+                self._send(302, headers=[("Location", "/login")])
+        elif match := re.match(r"/analysis/game/live/(\d+)/review", path):
+            if self._logged_in():
+                body = REVIEW_PAGE.format(game_id=match.group(1), delay_ms=self.page_delay_ms)
+                self._send(200, body.encode())
+            else:
+                self._send(302, headers=[("Location", "/login")])
+        else:
+            self._send(404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse(self.path).path == "/login":
+            self._send(302, headers=[("Location", "/home"), ("Set-Cookie", f"{SESSION_COOKIE}; Path=/; Max-Age=31536000")])
+        else:
+            self._send(404)
+
+
+# --- Fake Telegram Bot API ---
+
+class FakeTelegram:
+    """In-memory Bot API: queues synthetic updates and records the bot's replies."""
+
+    def __init__(self):
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.cond = threading.Condition()
+        self.sent = {}            # request_id -> time of the review link reply
+        self.failed = {}          # request_id -> time of the failure reply
+        self.rejected = {}        # request_id -> time of the queue rejection
+        self.api_calls = {}       # method -> count
+        self.pending = {}         # chat_id -> (request id, game id) awaiting a final reply, oldest first
+
+    def push_message(self, request_id, user_id, text):
+        game_id = re.search(r"/(\d+)", text).group(1)
+        with self.cond:
+            self.pending.setdefault(user_id, []).append((request_id, game_id))
+            self.updates.append({
+                "update_id": self.next_update_id,
+                "message": {
+                    "message_id": self.next_message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                    "text": text,
+                    "entities": [{"type": "url", "offset": 0, "length": len(text)}],
+                },
+            })
+            self.next_update_id += 1
+            self.next_message_id += 1
+            self.cond.notify_all()
+
+    def get_updates(self, offset, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                batch = [u for u in self.updates if u["update_id"] >= offset]
+                remaining = deadline - time.monotonic()
+                if batch or remaining <= 0:
+                    self.updates = batch
+                    return batch
+                self.cond.wait(remaining)
+
+    def message(self, chat_id, text=""):
+        with self.cond:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        return {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    def record_reply(self, chat_id, text):
+        """
+        Matches a final reply to its request. Review links name their game, so they go to
+        the oldest pending request for that game: the bot finishes a user's requests out
+        of order. Failures and rejections carry no game ID and go to the oldest request.
+        """
+        game_id = None
+        if text.startswith("Here is your Game review"):
+            bucket = self.sent
+            match = re.search(r"/(\d+)/review", text)
+            game_id = match.group(1) if match else None
+        elif text.startswith("Sorry, something went wrong"):
+            bucket = self.failed
+        elif text.startswith(("⏳ The bot is busy", "⏳ You already", "⏳ Slow down")):
+            bucket = self.rejected
+        else:
+            return
+        with self.cond:
+            queue = self.pending.get(chat_id)
+            if not queue:
+                return
+            index = next((i for i, (_, pending_game) in enumerate(queue) if pending_game == game_id), 0)
+            request_id, _ = queue.pop(index)
+            bucket[request_id] = time.monotonic()
+
+    def handle(self, method, params):
+        self.api_calls[method] = self.api_calls.get(method, 0) + 1
+        chat_id = int(params.get("chat_id", 0) or 0)
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getUpdates":
+            return self.get_updates(int(params.get("offset", 0) or 0), float(params.get("timeout", 0) or 0))
+        if method in ("deleteWebhook", "deleteMessage", "setWebhook"):
+            return True
+        if method in ("sendMessage", "editMessageText"):
+            self.record_reply(chat_id, params.get("text", ""))
+            return self.message(chat_id, params.get("text", ""))
+        if method == "sendPhoto":
+            return self.message(chat_id)
+        return True
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    telegram = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        method = self.path.rsplit("/", 1)[-1]
+        content_type = self.headers.get("Content-Type", "")
+        if "json" in content_type:
+            params = json.loads(body or b"{}")
+        elif "multipart" in content_type:
+            # Only chat_id matters for uploaded photos.
+            match = re.search(rb'name="chat_id"\r\n\r\n(-?\d+)', body)
+            params = {"chat_id": match.group(1).decode()} if match else {}
+        else:
+            params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        result = self.telegram.handle(method, params)
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def serve(handler, name):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=name, daemon=True).start()
+    return server
+
+
+# --- Process Accounting ---
+
+def process_tree_cpu_seconds(pid):
+    """User + system CPU seconds of a process and all its live descendants (Linux only)."""
+    ticks = os.sysconf("SC_CLK_TCK")
+    parents, cpu = {}, {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields[1])
+        cpu[int(entry)] = (int(fields[11]) + int(fields[12])) / ticks
+    tree, stack = set(), [pid]
+    while stack:
+        current = stack.pop()
+        tree.add(current)
+        stack.extend(child for child, parent in parents.items() if parent == current and child not in tree)
+    return sum(cpu.get(p, 0) for p in tree)
+
+
+def percentiles(samples):
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "mean": statistics.fmean(ordered)}
+
+
+# --- Benchmark Run ---
+
+async def run_benchmark(args, bot, telegram):
+    # Keep a reference to every job so queue wait and browser time can be read off its timestamps.
+    jobs = []
+    original_submit = bot.review_scheduler.submit
+
+    async def recording_submit(*submit_args, **submit_kwargs):
+        job = await original_submit(*submit_args, **submit_kwargs)
+        jobs.append(job)
+        return job
+
+    bot.review_scheduler.submit = recording_submit
+
+    bot_task = asyncio.create_task(bot.main())
+    logger.info("Waiting for the browser pool to warm up...")
+    warmup_started = time.monotonic()
+    ready = asyncio.create_task(bot.browser_pool.ready.wait())
+    await asyncio.wait([ready, bot_task], return_when=asyncio.FIRST_COMPLETED)
+    if not ready.done():
+        # main() returned early (missing Chrome, bad settings...); its log says why.
+        ready.cancel()
+        raise SystemExit("The bot stopped before the browser pool was ready; see the log above.")
+    warmup_seconds = time.monotonic() - warmup_started
+
+    pid = os.getpid()
+    cpu_before = process_tree_cpu_seconds(pid)
+    rss_samples = []
+
+    async def sample_rss():
+        while True:
+            rss_samples.append(bot.process_tree_rss(pid))
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.create_task(sample_rss())
+
+    submitted = {}
+    random.seed(args.seed)
+    started = time.monotonic()
+    for request_id in range(args.requests):
+        user_id = 1000 + random.randrange(args.users)
+        if submitted and random.random() < args.repeat_ratio:
+            game_id = 10_000_000 + random.randrange(len(submitted))
+        else:
+            game_id = 10_000_000 + request_id
+        submitted[request_id] = time.monotonic()
+        telegram.push_message(request_id, user_id, f"https://www.chess.com/live/game/{game_id}")
+        await asyncio.sleep(random.expovariate(args.rate) if args.poisson else 1 / args.rate)
+
+    logger.info("All requests submitted; waiting for replies...")
+    deadline = time.monotonic() + args.drain_timeout
+    answered = lambda: len(telegram.sent) + len(telegram.failed) + len(telegram.rejected)
+    while answered() < len(submitted) and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+    elapsed = time.monotonic() - started
+
+    sampler.cancel()
+    cpu_used = process_tree_cpu_seconds(pid) - cpu_before
+    bot_task.cancel()
+    await asyncio.gather(bot_task, return_exceptions=True)
+
+    completed = len(telegram.sent)
+    review_rss = [m[2] / 2**20 for m in bot.review_measurements]
+    return {
+        "settings": {
+            "users": args.users, "rate": args.rate, "requests": args.requests,
+            "pool_size": bot.BROWSER_POOL_SIZE, "browser_mode": bot.BROWSER_MODE,
+            "page_delay_ms": args.page_delay_ms, "repeat_ratio": args.repeat_ratio,
+        },
+        "warmup_seconds": warmup_seconds,
+        "elapsed_seconds": elapsed,
+        "completed": completed,
+        "failed": len(telegram.failed),
+        "rejected": len(telegram.rejected),
+        "unanswered": len(submitted) - answered(),
+        "reviews_per_minute": completed / elapsed * 60 if elapsed else 0,
+        "end_to_end_seconds": percentiles([telegram.sent[r] - submitted[r] for r in telegram.sent]),
+        "queue_wait_seconds": percentiles([j.started_at - j.submitted_at for j in jobs if j.started_at]),
+        "browser_seconds": percentiles([j.finished_at - j.started_at for j in jobs if j.finished_at]),
+        "page_ready_seconds": percentiles([m[1] for m in bot.review_measurements]),
+        "cpu_seconds_per_review": cpu_used / completed if completed else None,
+        "browser_rss_mb_per_review": percentiles(review_rss),
+        "peak_rss_mb": max(rss_samples, default=0) / 2**20,
+        "telegram_api_calls": dict(telegram.api_calls),
+    }
+
+
+def print_report(result, baseline=None):
+    def fmt(value):
+        return "-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    print("\n=== Benchmark results ===")
+    for key, value in result.items():
+        if isinstance(value, dict) and key != "telegram_api_calls" and key != "settings":
+            line = "  ".join(f"{name}={fmt(v)}" for name, v in value.items())
+            if baseline and isinstance(baseline.get(key), dict):
+                base, now = baseline[key].get("p50"), value.get("p50")
+                if base and now:
+                    line += f"  (p50 {100 * (now - base) / base:+.1f}% vs baseline)"
+            print(f"{key:28} {line}")
+        else:
+            line = fmt(value)
+            if baseline and isinstance(value, (int, float)) and isinstance(baseline.get(key), (int, float)) and baseline[key]:
+                line += f"  ({100 * (value - baseline[key]) / baseline[key]:+.1f}% vs baseline)"
+            print(f"{key:28} {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the review bot.")
+    parser.add_argument("--users", type=int, default=10, help="distinct synthetic Telegram users")
+    parser.add_argument("--rate", type=float, default=0.5, help="requests per second")
+    parser.add_argument("--requests", type=int, default=30, help="total requests to send")
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times instead of a fixed rate")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="share of requests that repeat an earlier game ID")
+    parser.add_argument("--page-delay-ms", type=int, default=500, help="how long the fake review page takes to render")
+    parser.add_argument("--drain-timeout", type=float, default=300, help="seconds to wait for outstanding replies")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results saved by an earlier --save")
+    args = parser.parse_args()
+
+    FakeChessHandler.page_delay_ms = args.page_delay_ms
+    telegram = FakeTelegram()
+    FakeTelegramHandler.telegram = telegram
+    chess_server = serve(FakeChessHandler, "fake-chess")
+    telegram_server = serve(FakeTelegramHandler, "fake-telegram")
+
+    # The bot reads its settings at import time and keeps its state in the working
+    # directory, so configure the environment and move into a scratch dir first.
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": BENCH_TOKEN,
+        "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{telegram_server.server_port}/bot",
+        "CHESS_BASE_URL": f"http://127.0.0.1:{chess_server.server_port}",
+        "CHESS_USERNAME": "bench",
+        "CHESS_PASSWORD": "bench",
+        "CREDIT_TIERS": "free:1000000",
+        "UPDATE_MODE": "polling",
+        # Measure the review pipeline, not the per-user spam limits.
+        "ADMISSION_USER_RATE": "1000",
+        "ADMISSION_USER_BURST": "1000",
+        "ADMISSION_GLOBAL_RATE": "1000",
+        "ADMISSION_GLOBAL_BURST": "1000",
+    })
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, cwd)
+    try:
+        import bot
+        result = asyncio.run(run_benchmark(args, bot, telegram))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        chess_server.shutdown()
+        telegram_server.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=4)
+        print(f"\nSaved results to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,41 +3,173 @@
 import os
 import logging
 import time
-from datetime import time as dt_time
 import shutil
 import asyncio
 import re
 import json
+import base64
+import functools
+import statistics
+import math
+import io
+import shlex
+import hashlib
+import secrets
+import socket
+import httpx
+import sqlite3
+import subprocess
+import threading
+import signal
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from http import HTTPStatus
+from urllib.parse import urlsplit
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
-from datetime import date
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 
 from telegram import Update, MessageEntity
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
+from telegram.error import RetryAfter
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from selenium_stealth import stealth
-
 # --- Configuration ---
 load_dotenv()
-selenium_lock = asyncio.Lock()
 
 # --- Paths ---
-LOCAL_PROFILE_PATH = os.path.join(os.getcwd(), "chrome_profile")
+PROFILES_DIR = os.path.join(os.getcwd(), "chrome_profiles")   # One Chrome profile per (account, pool slot)
 CONFIG_FILE = os.path.join(os.getcwd(), "config.json") # <-- ADDED: Path for persistent config
-USER_DATA_FILE = os.path.join(os.getcwd(), "user_data.json")
-
-# --- Credentials (will be loaded dynamically) ---
+USER_DATA_FILE = os.path.join(os.getcwd(), "user_data.json") # Legacy store, migrated into DATABASE_FILE
+DATABASE_FILE = os.path.join(os.getcwd(), "bot.db")
+REVIEW_CACHE_FILE = os.path.join(os.getcwd(), "review_cache.json")   # Legacy store, migrated into DATABASE_FILE
+DRIVER_CACHE_FILE = os.path.join(os.getcwd(), "driver_cache.json")
+
+# --- Endpoints (overridable so the benchmark can point the bot at local fakes) ---
+CHESS_BASE_URL = os.getenv("CHESS_BASE_URL", "https://www.chess.com").rstrip("/")
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL")                   # e.g. "http://127.0.0.1:8081/bot"
+
+# --- Deployment Settings ---
+BOT_ROLE = os.getenv("BOT_ROLE", "all")                            # "all" (one process), "frontend" (Telegram + job broker) or "worker" (browsers only)
+NODE_NAME = os.getenv("NODE_NAME", socket.gethostname())           # How this worker node shows up in /stats and the logs
+BROKER_LISTEN = os.getenv("BROKER_LISTEN", "0.0.0.0")
+BROKER_PORT = int(os.getenv("BROKER_PORT", 9200))                  # Front-end port worker nodes lease jobs from
+BROKER_URL = os.getenv("BROKER_URL", f"http://127.0.0.1:{BROKER_PORT}").rstrip("/")  # Where worker nodes reach the front-end
+BROKER_TOKEN = os.getenv("BROKER_TOKEN")                           # Shared secret between the front-end and its worker nodes
+BROKER_LEASE_SECONDS = float(os.getenv("BROKER_LEASE_SECONDS", 60))      # A job goes back to the queue if its node is silent this long
+BROKER_HEARTBEAT_SECONDS = float(os.getenv("BROKER_HEARTBEAT_SECONDS", 10))
+BROKER_POLL_SECONDS = float(os.getenv("BROKER_POLL_SECONDS", 25))        # How long a lease request waits for a job to arrive
+BROKER_MAX_ATTEMPTS = int(os.getenv("BROKER_MAX_ATTEMPTS", 3))           # Nodes a job may be lost by before it is refunded
+BROKER_MAX_BODY_BYTES = int(os.getenv("BROKER_MAX_BODY_BYTES", 8 * 2**20))  # Largest request body; fits a base64 full-page screenshot
+
+# --- Metrics Settings ---
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))                # Prometheus endpoint; 0 disables it
+
+# --- Update Ingestion Settings ---
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling")                  # "polling" (development) or "webhook"
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 64))      # Updates processed at the same time
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")                             # Public HTTPS base URL Telegram posts to
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")                       # Checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))  # Parallel deliveries Telegram may open
+
+# --- Browser Pool Settings ---
+CHROME_BINARY = os.getenv("CHROME_BINARY")                         # Chrome executable; searched on PATH if unset
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", 1))          # Browser worker processes, each with its own profile
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", 50))          # Recycle a browser after this many reviews
+BROWSER_MAX_RSS_MB = int(os.getenv("BROWSER_MAX_RSS_MB", 1500))    # ...or once a worker and its Chrome grow past this much memory
+REVIEW_JOB_TIMEOUT = float(os.getenv("REVIEW_JOB_TIMEOUT", 120))      # Hard limit for one review; the worker is killed after it
+WORKER_STARTUP_TIMEOUT = float(os.getenv("WORKER_STARTUP_TIMEOUT", 180))  # Hard limit for launching Chrome and logging in
+WORKER_COMMAND_TIMEOUT = float(os.getenv("WORKER_COMMAND_TIMEOUT", 15))   # Hard limit for health checks and shutdown
+BROWSER_MODE = os.getenv("BROWSER_MODE", "full")                  # "full" (visible, loads everything) or "lean"
+BROWSER_PAGE_LOAD_STRATEGY = os.getenv("BROWSER_PAGE_LOAD_STRATEGY", "eager")  # Lean mode only: "eager" or "none"
+SCREENSHOT_BUFFER_SIZE = int(os.getenv("SCREENSHOT_BUFFER_SIZE", 20))  # Failure screenshots kept in memory
+SCREENSHOT_SCALE = float(os.getenv("SCREENSHOT_SCALE", 0.5))          # Downscale factor for captured screenshots
+SCREENSHOT_JPEG_QUALITY = int(os.getenv("SCREENSHOT_JPEG_QUALITY", 60))
+REVIEW_QUEUE_SIZE = int(os.getenv("REVIEW_QUEUE_SIZE", 20))        # Jobs allowed to wait for a free worker
+REVIEW_MAX_PER_USER = int(os.getenv("REVIEW_MAX_PER_USER", 5))     # Jobs one user may have queued or running
+REVIEW_MAX_QUEUE_WAIT = float(os.getenv("REVIEW_MAX_QUEUE_WAIT", 600))  # Jobs not started after this long fail and are refunded; 0 waits forever
+MAX_LINKS_PER_MESSAGE = int(os.getenv("MAX_LINKS_PER_MESSAGE", 5))  # Game links reviewed from one message; extras are ignored
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", 1.5))  # Min seconds between status message edits
+
+# --- Admission Control Settings ---
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", 0.2))     # Review messages per second one user may send (sustained)...
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", 3))     # ...and back to back
+ADMISSION_GLOBAL_RATE = float(os.getenv("ADMISSION_GLOBAL_RATE", 20))  # Review messages per second across all users...
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", 60))  # ...and in a burst
+
+# --- Engine Analysis Settings ---
+ENGINE_PATH = os.getenv("ENGINE_PATH")                              # UCI engine command (e.g. stockfish); PGN analysis is off if unset
+ENGINE_POOL_SIZE = int(os.getenv("ENGINE_POOL_SIZE", os.cpu_count() or 1))  # Engine processes; each searches one position at a time
+ENGINE_THREADS = int(os.getenv("ENGINE_THREADS", 1))                # Threads per engine process
+ENGINE_HASH_MB = int(os.getenv("ENGINE_HASH_MB", 64))               # Hash table per engine process
+ENGINE_DEPTH = int(os.getenv("ENGINE_DEPTH", 0))                    # Depth per position; 0 to rely on ENGINE_MOVE_TIME alone
+ENGINE_MOVE_TIME = float(os.getenv("ENGINE_MOVE_TIME", 0.2))        # Seconds per position; 0 to rely on ENGINE_DEPTH alone
+ENGINE_MAX_PLIES = int(os.getenv("ENGINE_MAX_PLIES", 400))          # Longer games are analysed up to this many half-moves
+ENGINE_REPORT_MOVES = int(os.getenv("ENGINE_REPORT_MOVES", 12))     # Mistakes and blunders listed per game report
+ENGINE_QUEUE_SIZE = int(os.getenv("ENGINE_QUEUE_SIZE", 20))          # PGN games analysed or waiting at once; more are turned away
+ENGINE_MAX_PER_USER = int(os.getenv("ENGINE_MAX_PER_USER", 5))       # PGN games one user may have in progress at once
+PGN_MAX_BYTES = int(os.getenv("PGN_MAX_BYTES", 256 * 1024))         # Largest .pgn upload accepted
+
+# --- Outbound Message Settings ---
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", 25))   # Messages per second across all chats (Telegram allows ~30)
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", 1))         # Sustained messages per second to one chat
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", 3))       # Messages one chat may receive back to back
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", 3))       # Re-sends after a RetryAfter before giving up
+
+# --- Wait Policy Settings ---
+# Timeouts (seconds) per browser wait step until enough real samples have been seen.
+WAIT_DEFAULTS = {"review_page": 15, "review_ready": 20, "login_form": 20, "login_redirect": 20, "cookie_banner": 5}
+WAIT_PERCENTILE = float(os.getenv("WAIT_PERCENTILE", 0.99))        # Learned timeout = this percentile of recent waits...
+WAIT_FACTOR = float(os.getenv("WAIT_FACTOR", 2.0))                 # ...times this factor...
+WAIT_FLOOR_SECONDS = float(os.getenv("WAIT_FLOOR_SECONDS", 3))     # ...kept within this floor...
+WAIT_CEILING_SECONDS = float(os.getenv("WAIT_CEILING_SECONDS", 30))  # ...and ceiling
+WAIT_MIN_SAMPLES = int(os.getenv("WAIT_MIN_SAMPLES", 20))          # Successful waits needed before a step's timeout is learned
+WAIT_POLL_SECONDS = float(os.getenv("WAIT_POLL_SECONDS", 0.2))     # How often wait conditions are re-checked
+
+# --- Session Probe Settings ---
+SESSION_PROBE_INTERVAL = float(os.getenv("SESSION_PROBE_INTERVAL", 300))       # Seconds between background login checks
+SESSION_REFRESH_MARGIN_HOURS = float(os.getenv("SESSION_REFRESH_MARGIN_HOURS", 12))  # Re-login this long before cookies expire
+SESSION_COOKIE_NAMES = set(os.getenv("SESSION_COOKIE_NAMES", "CHESSCOM_REMEMBERME,PHPSESSID").split(","))
+SESSION_PROBE_URL = f"{CHESS_BASE_URL}/home"
+
+# --- Profile Maintenance Settings ---
+PROFILE_MAX_MB = int(os.getenv("PROFILE_MAX_MB", 500))                  # Prune a profile once it grows past this
+PROFILE_TARGET_MB = int(os.getenv("PROFILE_TARGET_MB", 250))            # ...down to this size
+PROFILE_CACHE_MAX_AGE_HOURS = float(os.getenv("PROFILE_CACHE_MAX_AGE_HOURS", 24))
+PROFILE_CHECK_INTERVAL = float(os.getenv("PROFILE_CHECK_INTERVAL", 600))
+
+# --- Job Journal Settings ---
+JOB_RESUME_MAX_AGE = float(os.getenv("JOB_RESUME_MAX_AGE", 3600))  # Unfinished reviews younger than this are redone after a restart, older ones refunded
+JOB_HISTORY_DAYS = float(os.getenv("JOB_HISTORY_DAYS", 7))          # Finished journal entries are kept this long
+
+# --- Review Cache Settings ---
+REVIEW_CACHE_TTL_HOURS = float(os.getenv("REVIEW_CACHE_TTL_HOURS", 24 * 7))
+REVIEW_CACHE_MAX_ENTRIES = int(os.getenv("REVIEW_CACHE_MAX_ENTRIES", 5000))
+
+# --- Credit Settings ---
+CREDIT_RESET_MODE = os.getenv("CREDIT_RESET_MODE", "daily")       # "daily" (midnight) or "rolling" (24h windows)
+CREDIT_TIMEZONE = os.getenv("CREDIT_TIMEZONE", "")                # e.g. "Asia/Kolkata"; empty means server time
+CREDIT_TIERS = os.getenv("CREDIT_TIERS", "free:3,premium:50")      # Credits per window for each tier
+
+# --- Credentials (chess.com accounts are loaded dynamically into account_pool) ---
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", 0))
-CHESS_USERNAME = None
-CHESS_PASSWORD = None
+ACCOUNT_COOLDOWN_SECONDS = float(os.getenv("ACCOUNT_COOLDOWN_SECONDS", 300))        # First time-out after a failed login/throttle
+ACCOUNT_COOLDOWN_MAX_SECONDS = float(os.getenv("ACCOUNT_COOLDOWN_MAX_SECONDS", 3600))
+# Page text (lowercased) that means chess.com served an error page instead of the content.
+PAGE_ERROR_MARKERS = {
+    "throttled": ("too many requests", "unusual activity", "temporarily blocked"),
+    "not_found": ("page not found", "game not found"),
+    "challenge": ("just a moment", "verify you are human"),
+}
 
 # --- Script Setup ---
 logging.basicConfig(
@@ -46,40 +178,231 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-# --- NEW: Configuration Management Functions ---
+# --- Metrics ---
 
-def save_credentials(username, password):
-    """Saves credentials to the config.json file."""
-    try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump({'CHESS_USERNAME': username, 'CHESS_PASSWORD': password}, f, indent=4)
-        logger.info(f"Credentials saved to {CONFIG_FILE}")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to save credentials: {e}")
-        return False
+# Histogram bucket upper bounds in seconds, shared by every stage timer.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 20, 30, 60)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=1000)  # Raw samples for the percentiles shown by /stats
 
-def load_credentials():
-    """Loads credentials, prioritizing config.json over .env file."""
-    global CHESS_USERNAME, CHESS_PASSWORD
+    def observe(self, value: float):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, q: float):
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+class Metrics:
+    """
+    In-memory histograms and counters, safe to update from browser threads.
+    Exposed in Prometheus text format on METRICS_PORT and summarised by /stats.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}    # (name, labels) -> int
+        self._forward = None
+
+    def forward_to(self, send):
+        """In a browser worker process: send every update to the supervisor instead of recording it."""
+        self._forward = send
+
+    def observe(self, name: str, seconds: float, **labels):
+        if self._forward:
+            self._forward(("observe", name, seconds, labels))
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.histograms.setdefault(key, Histogram()).observe(seconds)
+
+    def inc(self, name: str, amount: int = 1, **labels):
+        if self._forward:
+            self._forward(("inc", name, amount, labels))
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timed(self, name: str, **labels):
+        """Times the block, in sync or async code alike, and records it even if it raises."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def timed_method(self, name: str):
+        """Decorator that times a function under `name`, labelled with the function's name."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timed(name, op=func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE bot_{name}_total counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"bot_{name}_total{self._labels(labels)} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE bot_{name}_seconds histogram")
+                for (n, labels), hist in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(LATENCY_BUCKETS, hist.counts):
+                        lines.append(f"bot_{name}_seconds_bucket{self._labels(labels, [('le', bound)])} {count}")
+                    lines.append(f"bot_{name}_seconds_bucket{self._labels(labels, [('le', '+Inf')])} {hist.count}")
+                    lines.append(f"bot_{name}_seconds_sum{self._labels(labels)} {hist.sum}")
+                    lines.append(f"bot_{name}_seconds_count{self._labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Plain-text table of stage timings and counters for the /stats command."""
+        lines = ["Stage timings (count, p50 / p95 / max):"]
+        with self._lock:
+            for (name, labels), hist in sorted(self.histograms.items()):
+                label = name + "".join(f" {v}" for _, v in labels)
+                p50, p95 = hist.percentile(0.5), hist.percentile(0.95)
+                lines.append(f"  {label}: {hist.count}, {p50:.2f}s / {p95:.2f}s / {max(hist.recent):.2f}s")
+            lines.append("Counters:")
+            for (name, labels), value in sorted(self.counters.items()):
+                label = name + "".join(f" {k}={v}" for k, v in labels)
+                lines.append(f"  {label}: {value}")
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+
+class InstrumentedRequest(HTTPXRequest):
+    """Bot API transport that times every call by method (long-poll getUpdates excluded)."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        if api_method == "getUpdates":
+            return await super().do_request(url, method, *args, **kwargs)
+        with metrics.timed("telegram_api", method=api_method):
+            return await super().do_request(url, method, *args, **kwargs)
+
+async def serve_metrics(reader, writer):
+    """Minimal HTTP responder: any GET returns the Prometheus exposition."""
     try:
-        # Prioritize loading from config.json
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
-            CHESS_USERNAME = config.get('CHESS_USERNAME')
-            CHESS_PASSWORD = config.get('CHESS_PASSWORD')
-            if CHESS_USERNAME and CHESS_PASSWORD:
-                logger.info("Loaded credentials from config.json")
+        await reader.readuntil(b"\r\n\r\n")
+        body = metrics.render_prometheus().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+# --- NEW: Configuration Management Functions ---
+
+class ChessAccount:
+    """One chess.com login plus the load and health state used to balance work across accounts."""
+
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+        self.active_jobs = 0
+        self.last_used = 0.0
+        self.failures = 0               # Consecutive login failures / throttles
+        self.cooldown_until = 0.0
+
+    def available(self) -> bool:
+        return time.time() >= self.cooldown_until
+
+    def cool_down(self, reason: str):
+        """Takes the account out of rotation, backing off exponentially on repeated failures."""
+        self.failures += 1
+        seconds = min(ACCOUNT_COOLDOWN_SECONDS * 2 ** (self.failures - 1), ACCOUNT_COOLDOWN_MAX_SECONDS)
+        self.cooldown_until = time.time() + seconds
+        metrics.inc("account_cooldowns", account=self.username, reason=reason)
+        logger.warning(f"⏸ Account {self.username} out of rotation for {seconds:.0f}s ({reason}).")
+
+    def mark_healthy(self):
+        # A success that started before another slot's cooldown must not end it early.
+        if self.available():
+            self.failures = 0
+            self.cooldown_until = 0.0
+
+
+class AccountPool:
+    """The configured chess.com accounts, persisted in config.json."""
+
+    def __init__(self):
+        self.accounts = []
+
+    def get(self, username: str):
+        return next((a for a in self.accounts if a.username == username), None)
+
+    def load(self):
+        """Loads accounts, prioritizing config.json over the .env file."""
+        try:
+            # Prioritize loading from config.json
+            with open(CONFIG_FILE, 'r') as f:
+                config = json.load(f)
+            entries = config.get('ACCOUNTS')
+            if entries is None and config.get('CHESS_USERNAME'):
+                # Single-account layout written by older versions.
+                entries = [{'username': config['CHESS_USERNAME'], 'password': config.get('CHESS_PASSWORD')}]
+            self.accounts = [ChessAccount(e['username'], e['password']) for e in entries or [] if e.get('username') and e.get('password')]
+            if self.accounts:
+                logger.info(f"Loaded {len(self.accounts)} account(s) from config.json")
                 return
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Fallback to .env file if config.json is missing or invalid
-        logger.info("config.json not found or invalid, falling back to .env file.")
-    
-    CHESS_USERNAME = os.getenv("CHESS_USERNAME")
-    CHESS_PASSWORD = os.getenv("CHESS_PASSWORD")
-    logger.info("Loaded credentials from .env file.")
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Fallback to .env file if config.json is missing or invalid
+            logger.info("config.json not found or invalid, falling back to .env file.")
+
+        username, password = os.getenv("CHESS_USERNAME"), os.getenv("CHESS_PASSWORD")
+        self.accounts = [ChessAccount(username, password)] if username and password else []
+        logger.info("Loaded credentials from .env file.")
+
+    def save(self) -> bool:
+        """Saves the account list to the config.json file."""
+        try:
+            with open(CONFIG_FILE, 'w') as f:
+                json.dump({'ACCOUNTS': [{'username': a.username, 'password': a.password} for a in self.accounts]}, f, indent=4)
+            logger.info(f"Accounts saved to {CONFIG_FILE}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save accounts: {e}")
+            return False
+
+    def assign(self, slot: int):
+        """Round-robin account for a pool slot, or None when no account is configured."""
+        return self.accounts[slot % len(self.accounts)] if self.accounts else None
 
 
+account_pool = AccountPool()
+
 
 async def set_credits_command(update: Update, context: CallbackContext) -> None:
     """
@@ -95,428 +418,3011 @@ async def set_credits_command(update: Update, context: CallbackContext) -> None:
 
     try:
         target_user_id_str = context.args[0]
+        target_user_id = int(target_user_id_str)
         new_credit_amount = int(context.args[1])
     except (IndexError, ValueError):
         await update.message.reply_text("Usage: /setcredits <user_id> <amount>")
         return
 
-    user_data = load_user_data()
-
-    if target_user_id_str not in user_data:
+    if not credit_store.set_credits(target_user_id, new_credit_amount):
         await update.message.reply_text(f"Error: User with ID {target_user_id_str} not found in database.")
         return
 
-    # Update the credits and save
-    user_data[target_user_id_str]['credits'] = new_credit_amount
-    save_user_data(user_data)
-
     logger.info(f"Admin {requesting_user_id} set credits for user {target_user_id_str} to {new_credit_amount}.")
     await update.message.reply_text(f"Success! User {target_user_id_str}'s credits have been set to {new_credit_amount}.")
 
+async def set_tier_command(update: Update, context: CallbackContext) -> None:
+    """
+    Admin-only command to move a user to another credit tier.
+    Usage: /settier <user_id> <tier>
+    """
+    requesting_user_id = update.message.from_user.id
 
-# --- NEW: User Data Management Functions ---
-
-def load_user_data():
-    """Loads user data from the JSON file."""
-    try:
-        with open(USER_DATA_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # If the file doesn't exist or is empty, return an empty dictionary
-        return {}
-
-def save_user_data(data):
-    """Saves user data to the JSON file."""
-    with open(USER_DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
-
-
-def clean_chrome_profile():
-    """
-    Cleans the Chrome profile by keeping only essential files for session persistence,
-    preventing bloat and performance degradation over time.
-    """
-    logger.info("--- Starting Chrome Profile Cleanup ---")
-    temp_profile_path = LOCAL_PROFILE_PATH + "_temp"
-    
-    # The essential files and directories to keep the session alive
-    whitelist_items = {
-        "files": [
-            "Local State",
-            os.path.join("Default", "Cookies"),
-            os.path.join("Default", "Preferences"),
-            os.path.join("Default", "Visited Links")
-        ],
-        "dirs": [
-            os.path.join("Default", "Local Storage"),
-            os.path.join("Default", "Session Storage"),
-            os.path.join("Default", "databases"),
-            os.path.join("Default", "Network")
-        ]
-    }
+    # --- Admin Check ---
+    if requesting_user_id != ADMIN_USER_ID:
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
 
     try:
-        # Ensure we start with a clean slate for the temp directory
-        if os.path.exists(temp_profile_path):
-            shutil.rmtree(temp_profile_path)
-            
-        # Create the temporary profile directory structure
-        os.makedirs(temp_profile_path)
-        os.makedirs(os.path.join(temp_profile_path, "Default"))
-
-        logger.info(f"Copying whitelisted items to {temp_profile_path}")
-
-        # Copy whitelisted directories
-        for dir_path in whitelist_items["dirs"]:
-            source_dir = os.path.join(LOCAL_PROFILE_PATH, dir_path)
-            dest_dir = os.path.join(temp_profile_path, dir_path)
-            if os.path.exists(source_dir):
-                shutil.copytree(source_dir, dest_dir)
-
-        # Copy whitelisted files
-        for file_path in whitelist_items["files"]:
-            source_file = os.path.join(LOCAL_PROFILE_PATH, file_path)
-            dest_file = os.path.join(temp_profile_path, file_path)
-            if os.path.exists(source_file):
-                # Ensure destination directory exists before copying file
-                os.makedirs(os.path.dirname(dest_file), exist_ok=True)
-                shutil.copy2(source_file, dest_file) # copy2 preserves metadata
-
-        # Atomically replace the old profile with the cleaned one
-        logger.info("Replacing old profile with the cleaned version...")
-        shutil.rmtree(LOCAL_PROFILE_PATH)
-        os.rename(temp_profile_path, LOCAL_PROFILE_PATH)
-        
-        logger.info("✅ Chrome profile cleanup successful.")
+        target_user_id = int(context.args[0])
+        tier = context.args[1]
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /settier <user_id> <tier>")
+        return
 
-    except Exception as e:
-        logger.error(f"❌ An error occurred during profile cleanup: {e}")
-        # If cleanup fails, try to remove the temp dir to avoid issues on next run
-        if os.path.exists(temp_profile_path):
-            shutil.rmtree(temp_profile_path)
+    if tier not in credit_policy.tiers:
+        await update.message.reply_text(f"Unknown tier. Available tiers: {', '.join(credit_policy.tiers)}")
+        return
 
+    if not credit_store.set_tier(target_user_id, tier):
+        await update.message.reply_text(f"Error: User with ID {target_user_id} not found in database.")
+        return
 
+    logger.info(f"Admin {requesting_user_id} set tier for user {target_user_id} to {tier}.")
+    await update.message.reply_text(f"Success! User {target_user_id} is now on the '{tier}' tier ({credit_policy.quota(tier)} credits per window, from their next window).")
 
-# --- NEW: Scheduled Job Function ---
 
-async def reset_all_credits_daily():
+async def screenshots_command(update: Update, context: CallbackContext) -> None:
     """
-    This job runs every day at midnight to reset credits for all users.
+    Admin-only command to view recent failure screenshots from memory.
+    Usage: /screenshots [count]
     """
-    logger.info("--- Running Daily Credit Reset Job ---")
-    user_data = load_user_data()
-    if not user_data:
-        logger.info("No user data to reset. Exiting job.")
+    requesting_user_id = update.message.from_user.id
+
+    # --- Admin Check ---
+    if requesting_user_id != ADMIN_USER_ID:
+        await update.message.reply_text("You are not authorized to use this command.")
         return
 
-    users_reset_count = 0
-    for user_id in user_data:
-        # We simply reset the credits, the 'last_seen' date will be updated
-        # the next time they use the bot.
-        user_data[user_id]['credits'] = 3
-        users_reset_count += 1
-    
-    save_user_data(user_data)
-    logger.info(f"✅ Daily reset complete. Credits reset for {users_reset_count} user(s).")
+    try:
+        count = int(context.args[0]) if context.args else 3
+    except ValueError:
+        count = 0
+    if count < 1:
+        await update.message.reply_text("Usage: /screenshots [count]")
+        return
 
+    recent = list(failure_screenshots)[-count:]
+    if not recent:
+        await update.message.reply_text("No failure screenshots recorded.")
+        return
+
+    for entry in reversed(recent):
+        taken_at = datetime.fromtimestamp(entry['at']).strftime("%Y-%m-%d %H:%M:%S")
+        caption = f"{taken_at}\n{entry['url']}\n{entry['error']}"[:1024]
+        await update.message.reply_photo(entry['image'], caption=caption)
 
-# --- Main Chess Logic (Unchanged) ---
-def run_chess_login_flow(game_url: str):
+
+async def stats_command(update: Update, context: CallbackContext) -> None:
     """
-    Final version combining a file-based check with a self-healing login.
-    - If no profile exists, it does a clean initial login.
-    - If a profile exists, it navigates directly and re-logs in only if the session has expired.
+    Admin-only command that shows per-stage latency percentiles and counters.
+    Usage: /stats
     """
-    logger.info("--- Starting Final Combined Chess.com Flow ---")
+    requesting_user_id = update.message.from_user.id
 
-    if not CHESS_USERNAME or not CHESS_PASSWORD:
-        logger.error("Chess.com username or password is not set. Please use /setconfig.")
+    # --- Admin Check ---
+    if requesting_user_id != ADMIN_USER_ID:
+        await update.message.reply_text("You are not authorized to use this command.")
         return
 
-    profile_exists = os.path.exists(LOCAL_PROFILE_PATH) and os.listdir(LOCAL_PROFILE_PATH)
+    nodes = ", ".join(f"{node} ({count})" for node, count in review_scheduler.leases.items()) or "none busy"
+    report = (
+        f"Queue: {review_scheduler.pending} waiting, {review_scheduler.running} running "
+        f"on {review_scheduler.workers} worker(s)\n"
+        + (f"Worker nodes: {nodes}\n" if BOT_ROLE == "frontend" else "")
+        + f"Outbox: {outbox.pending} message(s) waiting\n"
+        + metrics.summary()
+    )
+    # Telegram caps messages at 4096 characters.
+    await update.message.reply_text(report[:4096])
+
+
+# --- Credit Policy ---
+
+def parse_tiers(spec: str) -> dict:
+    """Parses 'free:3,premium:50' into {'free': 3, 'premium': 50}."""
+    tiers = {}
+    for item in spec.split(","):
+        name, _, quota = item.strip().partition(":")
+        if name:
+            tiers[name] = int(quota)
+    tiers.setdefault("free", 3)
+    return tiers
+
+
+class CreditPolicy:
+    """
+    Decides lazily, per user and on access, whether a new credit window has begun.
+    'daily' windows start at midnight in CREDIT_TIMEZONE (server time if unset);
+    'rolling' windows last 24 hours from the first request after the previous one ended.
+    """
+
+    def __init__(self, mode: str, timezone_name: str, tiers: dict):
+        if mode not in ("daily", "rolling"):
+            raise ValueError(f"Unknown CREDIT_RESET_MODE: {mode}")
+        self.mode = mode
+        self.timezone_name = timezone_name
+        self.tz = ZoneInfo(timezone_name) if timezone_name else None
+        self.tiers = tiers
+
+    def quota(self, tier: str) -> int:
+        return self.tiers.get(tier, self.tiers["free"])
+
+    def current_window(self, previous_window, now: datetime) -> str:
+        """Returns the window key for `now`; equal to previous_window while that window is still open."""
+        local_now = now.astimezone(self.tz)
+        if self.mode == "daily":
+            return local_now.date().isoformat()
+        if previous_window:
+            start = self._window_start(previous_window)
+            if local_now - start < timedelta(days=1):
+                return previous_window
+        return local_now.isoformat(timespec="seconds")
+
+    def _window_start(self, window: str) -> datetime:
+        # Older rows store a plain date; treat it as the start of that day.
+        start = datetime.fromisoformat(window)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=self.tz) if self.tz else start.astimezone()
+        return start
+
+    def reset_hint(self, window: str) -> str:
+        """Human-readable description of when the user's credits come back."""
+        zone = f" ({self.timezone_name})" if self.timezone_name else ""
+        if self.mode == "daily":
+            return f"at midnight{zone}"
+        reset_at = (self._window_start(window) + timedelta(days=1)).astimezone(self.tz)
+        return f"at {reset_at:%H:%M}{zone}"
+
+
+credit_policy = CreditPolicy(CREDIT_RESET_MODE, CREDIT_TIMEZONE, parse_tiers(CREDIT_TIERS))
+
+
+# --- User Data Management (SQLite) ---
+
+class CreditStore:
+    """
+    Small repository over a SQLite database in WAL mode. Every credit change is a
+    single indexed UPDATE, so concurrent handlers can't lose updates and a message
+    costs the same no matter how many users exist. Credits are replenished lazily
+    by the CreditPolicy when a user shows up in a new window, never in a sweep.
+    """
+
+    def __init__(self, path: str, policy: CreditPolicy):
+        self.path = path
+        self.policy = policy
+        self._conn = None
+        self._lock = threading.Lock()  # One connection shared by the event loop and worker threads
+
+    def open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " user_id INTEGER PRIMARY KEY,"
+                " credits INTEGER NOT NULL,"
+                " credit_window TEXT NOT NULL,"
+                " tier TEXT NOT NULL DEFAULT 'free')"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(users)")}
+            if "last_seen" in columns:
+                # Databases created before lazy windows stored the last-seen date instead.
+                self._conn.execute("ALTER TABLE users RENAME COLUMN last_seen TO credit_window")
+            if "tier" not in columns:
+                self._conn.execute("ALTER TABLE users ADD COLUMN tier TEXT NOT NULL DEFAULT 'free'")
+            # Journal of paid reviews, so a restart can finish or refund what was in flight.
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " user_id INTEGER NOT NULL,"
+                " game_id TEXT NOT NULL,"
+                " chat_id INTEGER NOT NULL,"
+                " status TEXT NOT NULL,"          # queued, running, done or failed
+                " charged INTEGER NOT NULL,"      # Credits given back if the job fails
+                " error TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (user_id, game_id))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            # Completed reviews, so repeat links skip the browser even after a restart.
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS reviews ("
+                " game_id TEXT PRIMARY KEY,"
+                " url TEXT NOT NULL,"
+                " at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (time.time() - JOB_HISTORY_DAYS * 86400,),
+            )
+        self._migrate_json(USER_DATA_FILE)
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _migrate_json(self, json_path: str):
+        """One-time import of the legacy user_data.json; the file is renamed afterwards."""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r') as f:
+                legacy = json.load(f)
+        except json.JSONDecodeError:
+            legacy = {}
+        rows = [(int(uid), entry.get('credits', 0), entry.get('last_seen', '')) for uid, entry in legacy.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO users (user_id, credits, credit_window) VALUES (?, ?, ?)", rows)
+        os.rename(json_path, json_path + ".migrated")
+        logger.info(f"Migrated {len(rows)} user(s) from {json_path} to {self.path}")
+
+    @metrics.timed_method("user_data_io")
+    def refresh(self, user_id: int):
+        """
+        Creates the user or tops them up if their credit window has rolled over.
+        Returns (credits, window) for the user's current window.
+        """
+        now = datetime.now().astimezone()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT credits, credit_window, tier FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                window = self.policy.current_window(None, now)
+                credits = self.policy.quota("free")
+                self._conn.execute(
+                    "INSERT INTO users (user_id, credits, credit_window) VALUES (?, ?, ?)",
+                    (user_id, credits, window),
+                )
+                return credits, window
+
+            credits, previous_window, tier = row
+            window = self.policy.current_window(previous_window, now)
+            if window != previous_window:
+                credits = self.policy.quota(tier)
+                self._conn.execute(
+                    "UPDATE users SET credits = ?, credit_window = ? WHERE user_id = ?",
+                    (credits, window, user_id),
+                )
+            return credits, window
+
+    @metrics.timed_method("user_data_io")
+    def start_jobs(self, user_id: int, game_ids: list, chat_id: int):
+        """
+        Spends one credit per game and journals each game as a queued job, in one
+        transaction. Returns the credits left, or None if there were not enough.
+        Raises DuplicateJobError if one of the games is already queued or running for the user.
+        """
+        now = time.time()
+        marks = ",".join("?" * len(game_ids))
+        with self._lock, self._conn:
+            active = self._conn.execute(
+                f"SELECT 1 FROM jobs WHERE user_id = ? AND game_id IN ({marks}) AND status IN ('queued', 'running')",
+                (user_id, *game_ids),
+            ).fetchone()
+            if active:
+                raise DuplicateJobError("⏳ You already sent this game, it is still being reviewed.")
+            row = self._conn.execute(
+                "UPDATE users SET credits = credits - ? WHERE user_id = ? AND credits >= ? RETURNING credits",
+                (len(game_ids), user_id, len(game_ids)),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO jobs (user_id, game_id, chat_id, status, charged, error, created_at, updated_at)"
+                " VALUES (?, ?, ?, 'queued', 1, NULL, ?, ?)",
+                [(user_id, game_id, chat_id, now, now) for game_id in game_ids],
+            )
+        return row[0]
+
+    @metrics.timed_method("user_data_io")
+    def mark_job_running(self, user_id: int, game_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE user_id = ? AND game_id = ? AND status = 'queued'",
+                (time.time(), user_id, game_id),
+            )
+
+    @metrics.timed_method("user_data_io")
+    def finish_job(self, user_id: int, game_id: str, ok: bool, error=None) -> bool:
+        """
+        Closes a journaled job as done or failed, refunding its credit on failure.
+        Only the first call for a job has any effect. Returns True if a credit was refunded.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?"
+                " WHERE user_id = ? AND game_id = ? AND status IN ('queued', 'running') RETURNING charged",
+                ("done" if ok else "failed", error, time.time(), user_id, game_id),
+            ).fetchone()
+            if row is None or ok or not row[0]:
+                return False
+            self._conn.execute("UPDATE users SET credits = credits + ? WHERE user_id = ?", (row[0], user_id))
+        return True
+
+    @metrics.timed_method("user_data_io")
+    def unfinished_jobs(self) -> list:
+        """(user_id, game_id, chat_id, created_at) of every queued or running job, oldest first."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT user_id, game_id, chat_id, created_at FROM jobs"
+                " WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
 
+    @metrics.timed_method("user_data_io")
+    def cached_reviews(self, since: float) -> list:
+        """(game_id, url, at) of every review stored after since, oldest first; older ones are deleted."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM reviews WHERE at < ?", (since,))
+            return self._conn.execute("SELECT game_id, url, at FROM reviews ORDER BY at").fetchall()
+
+    @metrics.timed_method("user_data_io")
+    def store_reviews(self, rows: list, evicted=()):
+        """Upserts (game_id, url, at) rows and drops the evicted game IDs, in one transaction."""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO reviews (game_id, url, at) VALUES (?, ?, ?)", rows)
+            self._conn.executemany("DELETE FROM reviews WHERE game_id = ?", [(game_id,) for game_id in evicted])
+
+    @metrics.timed_method("user_data_io")
+    def set_credits(self, user_id: int, amount: int) -> bool:
+        """Returns False if the user does not exist."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("UPDATE users SET credits = ? WHERE user_id = ?", (amount, user_id))
+        return cursor.rowcount > 0
+
+    @metrics.timed_method("user_data_io")
+    def set_tier(self, user_id: int, tier: str) -> bool:
+        """Changes the user's tier; the new quota applies from their next window. False if unknown user."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("UPDATE users SET tier = ? WHERE user_id = ?", (tier, user_id))
+        return cursor.rowcount > 0
+
+
+class DuplicateJobError(Exception):
+    """The user already has this game queued or running; the message is safe to show to the user."""
+
+
+credit_store = CreditStore(DATABASE_FILE, credit_policy)
+
+
+# --- Review Cache ---
+
+class ReviewCache:
+    """
+    TTL + LRU cache of completed reviews keyed by chess.com game ID. Lookups are
+    served from memory; each new review is one row written to the credit store's
+    database, so repeat links skip the browser even after a restart.
+    """
+
+    def __init__(self, store: CreditStore, ttl_seconds: float, max_entries: int):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # game_id -> {'url': ..., 'at': unix time}, oldest first
+
+    def load(self):
+        """Loads unexpired reviews from the database, after importing the legacy JSON file."""
+        self._migrate_json(REVIEW_CACHE_FILE)
+        for game_id, url, at in self.store.cached_reviews(time.time() - self.ttl_seconds):
+            self.entries[game_id] = {'url': url, 'at': at}
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        logger.info(f"Loaded {len(self.entries)} cached review(s).")
+
+    def _migrate_json(self, json_path: str):
+        """One-time import of the legacy review_cache.json; the file is renamed afterwards."""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r') as f:
+                legacy = json.load(f)
+        except json.JSONDecodeError:
+            legacy = {}
+        self.store.store_reviews([(game_id, entry['url'], entry['at']) for game_id, entry in legacy.items()])
+        os.rename(json_path, json_path + ".migrated")
+        logger.info(f"Migrated {len(legacy)} cached review(s) from {json_path}")
+
+    def get(self, game_id: str):
+        entry = self.entries.get(game_id)
+        if entry is not None and time.time() - entry['at'] >= self.ttl_seconds:
+            del self.entries[game_id]
+            entry = None
+        metrics.inc("review_cache", result="hit" if entry else "miss")
+        if entry is None:
+            return None
+        self.entries.move_to_end(game_id)
+        return entry['url']
+
+    def put(self, game_id: str, url: str):
+        entry = {'url': url, 'at': time.time()}
+        self.entries[game_id] = entry
+        self.entries.move_to_end(game_id)
+        evicted = []
+        while len(self.entries) > self.max_entries:
+            evicted.append(self.entries.popitem(last=False)[0])
+        self.store.store_reviews([(game_id, url, entry['at'])], evicted)
+
+
+review_cache = ReviewCache(credit_store, REVIEW_CACHE_TTL_HOURS * 3600, REVIEW_CACHE_MAX_ENTRIES)
+
+# game_id -> future of the review currently running for it, so concurrent
+# requests for the same game share a single browser run (single-flight).
+inflight_reviews = {}
+
+def start_flight(game_id: str, analysis_url: str):
+    """
+    Registers a review as in flight and returns the future followers wait on.
+    Must be called without awaiting after the inflight check, so two handlers
+    can never both become the leader for one game.
+    """
+    flight = asyncio.get_running_loop().create_future()
+    inflight_reviews[game_id] = flight
+
+    def on_done(future):
+        inflight_reviews.pop(game_id, None)
+        if not future.cancelled() and future.exception() is None:
+            try:
+                review_cache.put(game_id, analysis_url)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to persist review cache: {e}")
+
+    flight.add_done_callback(on_done)
+    return flight
+
+def chain_flight(flight, job_future):
+    """Settles the flight with whatever the underlying job ends up doing."""
+    def copy_outcome(future):
+        if flight.done():
+            return
+        if future.cancelled():
+            flight.cancel()
+        elif future.exception() is not None:
+            flight.set_exception(future.exception())
+        else:
+            flight.set_result(future.result())
+
+    job_future.add_done_callback(copy_outcome)
+
+
+# --- Chrome Profile Maintenance ---
+
+# Profile sub-directories that only hold caches Chrome can rebuild; everything else
+# (cookies, local storage, preferences) is left alone so the login survives.
+PRUNABLE_PROFILE_DIRS = [
+    os.path.join("Default", "Cache"),
+    os.path.join("Default", "Code Cache"),
+    os.path.join("Default", "GPUCache"),
+    os.path.join("Default", "DawnCache"),
+    os.path.join("Default", "Service Worker", "CacheStorage"),
+    os.path.join("Default", "Service Worker", "ScriptCache"),
+    "GrShaderCache",
+    "GraphiteDawnCache",
+    "ShaderCache",
+    "component_crx_cache",
+    "optimization_guide_model_store",
+]
+
+def directory_size(path: str) -> int:
+    """Total size in bytes of all files below path."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def prune_chrome_profile(profile_path: str, target_bytes: int, max_age_seconds=None):
+    """
+    Deletes cache files in place, oldest first, until the profile is at or below
+    target_bytes and no cache file is older than max_age_seconds. Returns
+    (bytes_reclaimed, seconds_spent).
+    """
+    started = time.monotonic()
+    size = directory_size(profile_path)
+    if size <= target_bytes and max_age_seconds is None:
+        return 0, time.monotonic() - started
+    cutoff = time.time() - max_age_seconds if max_age_seconds is not None else float("-inf")
+
+    candidates = []
+    for cache_dir in PRUNABLE_PROFILE_DIRS:
+        for root, _, files in os.walk(os.path.join(profile_path, cache_dir)):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.lstat(file_path)
+                except OSError:
+                    continue
+                candidates.append((stat.st_mtime, stat.st_size, file_path))
+    candidates.sort()
+
+    reclaimed = 0
+    for mtime, file_size, file_path in candidates:
+        if size - reclaimed <= target_bytes and mtime >= cutoff:
+            break
+        try:
+            os.remove(file_path)
+            reclaimed += file_size
+        except OSError:
+            pass
+    return reclaimed, time.monotonic() - started
+
+
+# --- Browser Stack Setup ---
+
+# Filled in by load_browser_stack(); Selenium is only imported once the bot is already polling.
+webdriver = ChromeService = By = WebDriverWait = EC = TimeoutException = stealth = None
+
+# Resolved once at startup by resolve_browser_binaries() and reused by every create_driver call.
+CHROMEDRIVER_PATH = os.getenv("CHROMEDRIVER_PATH")
+CHROMEDRIVER_VERSION = None
+CHROME_VERSION = None
+
+def load_browser_stack():
+    """Imports Selenium and its helpers into module globals."""
+    global webdriver, ChromeService, By, WebDriverWait, EC, TimeoutException, stealth
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service as ChromeService
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+    from selenium_stealth import stealth
+
+def binary_version(path: str):
+    """Runs `<binary> --version` and returns the dotted version it prints, or None."""
+    try:
+        output = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=15).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"(\d+)\.(\d+)\.(\d+)\.(\d+)", output)
+    return match.group(0) if match else None
+
+def resolve_browser_binaries():
+    """
+    Finds Chrome, resolves a matching ChromeDriver and verifies both, once per process.
+    The driver path is cached in DRIVER_CACHE_FILE so restarts skip webdriver-manager's
+    network lookups entirely. Raises RuntimeError with an actionable message on failure.
+    """
+    global CHROMEDRIVER_PATH, CHROMEDRIVER_VERSION, CHROME_VERSION
+    started = time.monotonic()
+    load_browser_stack()
+
+    candidates = [CHROME_BINARY] if CHROME_BINARY else ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser"]
+    for name in candidates:
+        chrome_path = shutil.which(name)
+        CHROME_VERSION = chrome_path and binary_version(chrome_path)
+        if CHROME_VERSION:
+            break
+    else:
+        raise RuntimeError(f"Chrome was not found (tried {', '.join(candidates)}). Install it or set CHROME_BINARY.")
+    chrome_major = CHROME_VERSION.split(".")[0]
+
+    if not CHROMEDRIVER_PATH:
+        try:
+            with open(DRIVER_CACHE_FILE, 'r') as f:
+                cached = json.load(f)
+            if cached.get('chrome_major') == chrome_major and os.path.exists(cached.get('path', '')):
+                CHROMEDRIVER_PATH = cached['path']
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    if not CHROMEDRIVER_PATH:
+        logger.info("Resolving ChromeDriver with webdriver-manager...")
+        from webdriver_manager.chrome import ChromeDriverManager
+        try:
+            CHROMEDRIVER_PATH = ChromeDriverManager().install()
+        except Exception as e:
+            raise RuntimeError(f"Could not download ChromeDriver ({e}). Check network access or set CHROMEDRIVER_PATH.") from e
+
+    CHROMEDRIVER_VERSION = binary_version(CHROMEDRIVER_PATH)
+    if not CHROMEDRIVER_VERSION:
+        raise RuntimeError(f"ChromeDriver at {CHROMEDRIVER_PATH} does not run.")
+    if CHROMEDRIVER_VERSION.split(".")[0] != chrome_major:
+        raise RuntimeError(f"ChromeDriver {CHROMEDRIVER_VERSION} does not match Chrome {CHROME_VERSION}.")
+
+    with open(DRIVER_CACHE_FILE, 'w') as f:
+        json.dump({'path': CHROMEDRIVER_PATH, 'chrome_major': chrome_major}, f)
+    logger.info(
+        f"✅ Browser stack ready in {time.monotonic() - started:.2f}s: "
+        f"Chrome {CHROME_VERSION}, ChromeDriver {CHROMEDRIVER_VERSION} at {CHROMEDRIVER_PATH}"
+    )
+
+def reviews_configured() -> bool:
+    """True if reviews can run: accounts are set here, or worker nodes hold their own."""
+    return BOT_ROLE == "frontend" or bool(account_pool.accounts)
+
+async def prepare_browser_tier():
+    """Resolves the browser binaries off the event loop, then warms up the pool."""
+    await asyncio.to_thread(resolve_browser_binaries)
+    await browser_pool.start()
+
+
+# --- Main Chess Logic ---
+
+# Blocked in lean mode: heavy static media plus ad/analytics hosts the review check never needs.
+LEAN_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp3", "*.mp4", "*.webm", "*.ogg", "*.wav",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*googlesyndication.com*", "*adservice.google.*", "*amazon-adsystem.com*",
+    "*adnxs.com*", "*facebook.net*", "*facebook.com/tr*", "*hotjar.com*",
+    "*scorecardresearch.com*", "*quantserve.com*", "*pubmatic.com*",
+    "*rubiconproject.com*", "*criteo.*", "*taboola.com*", "*outbrain.com*",
+]
+
+def create_driver(profile_path: str):
+    """
+    Launches a stealth Chrome instance bound to the given profile directory.
+    In BROWSER_MODE=lean it runs headless with a small viewport, no images,
+    an early page-load strategy and CDP-level blocking of media and trackers.
+    """
+    lean = BROWSER_MODE == "lean"
     options = webdriver.ChromeOptions()
-    #options.add_argument("--headless")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--window-size=1280,800")
-    options.add_argument(f"--user-data-dir={LOCAL_PROFILE_PATH}")
-
-    driver = None
+    options.add_argument(f"--user-data-dir={profile_path}")
+    if lean:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=800,600")
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_argument("--mute-audio")
+        options.add_argument("--disable-extensions")
+        options.page_load_strategy = BROWSER_PAGE_LOAD_STRATEGY
+    else:
+        options.add_argument("--window-size=1280,800")
+
+    logger.info(f"Initializing WebDriver with Stealth ({BROWSER_MODE} mode)...")
+    service = ChromeService(CHROMEDRIVER_PATH)
+    driver = webdriver.Chrome(service=service, options=options)
+
+    # Headless Chrome announces itself in the user agent; present as regular Chrome instead.
+    user_agent = driver.execute_script("return navigator.userAgent").replace("HeadlessChrome", "Chrome")
+    stealth(driver, user_agent=user_agent, languages=["en-US", "en"], vendor="Google Inc.", platform="Win32", webgl_vendor="Intel Inc.", renderer="Intel Iris OpenGL Engine", fix_hairline=True)
+
+    if lean:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URLS})
+    return driver
+
+START_REVIEW_BUTTON = "//span[text()='Start Review']"
+COOKIE_BUTTON = "//button[contains(., 'Accept')] | //button[contains(., 'Allow all')]"
+
+class PageError(Exception):
+    """chess.com served a known error page (throttle, missing game, bot challenge) instead of the content."""
+
+    def __init__(self, kind: str):
+        super().__init__(f"chess.com returned a {kind} page")
+        self.kind = kind
+
+def page_error_kind(driver, title_only=False):
+    """
+    Returns the PAGE_ERROR_MARKERS kind the current page matches, or None.
+    title_only skips the body text, whose innerText forces a layout of the whole page.
+    """
+    script = "return document.title" if title_only else (
+        "return document.title + '\\n' + (document.body ? document.body.innerText.slice(0, 3000) : '')"
+    )
     try:
-        logger.info("Initializing WebDriver with Stealth...")
-        service = ChromeService(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
-        
-        stealth(driver, languages=["en-US", "en"], vendor="Google Inc.", platform="Win32", webgl_vendor="Intel Inc.", renderer="Intel Iris OpenGL Engine", fix_hairline=True)
-        
-        if profile_exists:
-            # --- PATH 1: PROFILE EXISTS (SELF-HEALING LOGIC) ---
-            logger.info("Profile found. Using direct navigation with self-healing check.")
-            driver.get(game_url)
+        text = driver.execute_script(script).lower()
+    except Exception:
+        return None
+    for kind, markers in PAGE_ERROR_MARKERS.items():
+        if any(marker in text for marker in markers):
+            return kind
+    return None
+
+
+class WaitPolicy:
+    """
+    Timeouts for each browser wait step, learned from how long that step has
+    actually taken: the WAIT_PERCENTILE of recent successful waits times
+    WAIT_FACTOR, kept between WAIT_FLOOR_SECONDS and WAIT_CEILING_SECONDS.
+    Steps without WAIT_MIN_SAMPLES successes yet use their WAIT_DEFAULTS value.
+    A timeout counts as a sample of its own length, so a step that has slowed down
+    raises its learned timeout again instead of failing forever at the floor.
+    Every poll also checks the page title for known error pages, so those fail at
+    once; the page text is only checked after a timeout.
+    """
+
+    def __init__(self, defaults: dict, percentile: float, factor: float, floor: float, ceiling: float, min_samples: int):
+        self.defaults = defaults
+        self.percentile = percentile
+        self.factor = factor
+        self.floor = floor
+        self.ceiling = ceiling
+        self.min_samples = min_samples
+        self.samples = {}  # step -> deque of seconds
+
+    def timeout(self, step: str) -> float:
+        samples = self.samples.get(step)
+        if not samples or len(samples) < self.min_samples:
+            return self.defaults[step]
+        ordered = sorted(samples)
+        learned = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))] * self.factor
+        return min(self.ceiling, max(self.floor, learned))
+
+    def record(self, step: str, seconds: float):
+        self.samples.setdefault(step, deque(maxlen=200)).append(seconds)
+
+    def wait(self, driver, step: str, condition):
+        """WebDriverWait.until with this step's timeout; raises PageError as soon as an error page shows."""
+        def check(driver):
+            kind = page_error_kind(driver, title_only=True)
+            if kind:
+                raise PageError(kind)
+            return condition(driver)
+
+        timeout = self.timeout(step)
+        started = time.monotonic()
+        with metrics.timed("browser_stage", op=f"wait_{step}"):
             try:
-                # Wait up to 15 seconds to see if the session is still active.
-                wait = WebDriverWait(driver, 15)
-                wait.until(EC.element_to_be_clickable((By.XPATH, "//span[text()='Start Review']")))
-                logger.info("✅ Session is active. Analysis page loaded directly.")
-            except TimeoutException:
-                # Session expired, so we re-authenticate.
-                logger.warning("Session expired despite profile existing. Re-authenticating...")
-                
-                # Standard Login Flow
-                login_wait = WebDriverWait(driver, 10)
-                username_field = login_wait.until(EC.element_to_be_clickable((By.ID, "login-username")))
-                username_field.clear()
-                username_field.send_keys(CHESS_USERNAME)
-                password_field = driver.find_element(By.ID, "login-password")
-                password_field.clear()
-                password_field.send_keys(CHESS_PASSWORD)
-                driver.find_element(By.ID, "login").click()
-
-                login_wait.until(EC.url_contains("/home"))
-                logger.info("Re-authentication successful. Navigating back to game URL...")
-                driver.get(game_url)
-        else:
-            # --- PATH 2: NO PROFILE (CLEAN INITIAL LOGIN) ---
-            logger.info("No profile found. Performing clean initial login.")
-            driver.get("https://www.chess.com/login")
-            
-            wait = WebDriverWait(driver, 20)
-            try: # Handle cookie banner
-                cookie_button = WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Accept')] | //button[contains(., 'Allow all')]")))
-                cookie_button.click()
-                time.sleep(1)
+                result = WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL_SECONDS).until(check)
+            except TimeoutException as e:
+                metrics.inc("wait_timeouts", step=step)
+                kind = page_error_kind(driver)
+                if kind:
+                    raise PageError(kind) from e
+                # The step took at least this long; recording it lets the timeout grow back.
+                self.record(step, timeout)
+                raise
+        self.record(step, time.monotonic() - started)
+        return result
+
+
+# Per process: every browser worker learns from the pages it has loaded itself.
+wait_policy = WaitPolicy(WAIT_DEFAULTS, WAIT_PERCENTILE, WAIT_FACTOR, WAIT_FLOOR_SECONDS, WAIT_CEILING_SECONDS, WAIT_MIN_SAMPLES)
+
+def dismiss_cookie_banner(driver):
+    """Clicks the cookie banner away if it is showing right now; never waits for one to appear."""
+    for button in driver.find_elements(By.XPATH, COOKIE_BUTTON):
+        if button.is_displayed():
+            button.click()
+            try:
+                wait_policy.wait(driver, "cookie_banner", EC.invisibility_of_element(button))
             except TimeoutException:
-                logger.info("Cookie banner not found, continuing.")
-            
-            username_field = wait.until(EC.element_to_be_clickable((By.ID, "login-username")))
-            username_field.clear()
-            username_field.send_keys(CHESS_USERNAME)
-            password_field = driver.find_element(By.ID, "login-password")
-            password_field.clear()
-            password_field.send_keys(CHESS_PASSWORD)
-            driver.find_element(By.ID, "login").click()
-
-            wait.until(EC.url_contains("/home"))
-            logger.info("Initial login successful. Now navigating to game URL.")
+                logger.warning("Cookie banner did not disappear after the click, continuing anyway.")
+            return
+
+@metrics.timed_method("browser_stage")
+def login(driver, account: ChessAccount):
+    """Performs the chess.com login form flow for an account and waits for the /home redirect."""
+    metrics.inc("logins", account=account.username)
+    driver.get(f"{CHESS_BASE_URL}/login")
+
+    username_field = wait_policy.wait(driver, "login_form", EC.element_to_be_clickable((By.ID, "login-username")))
+    dismiss_cookie_banner(driver)
+    username_field.clear()
+    username_field.send_keys(account.username)
+    password_field = driver.find_element(By.ID, "login-password")
+    password_field.clear()
+    password_field.send_keys(account.password)
+    dismiss_cookie_banner(driver)  # It can slide in while typing and would swallow the click
+    driver.find_element(By.ID, "login").click()
+
+    try:
+        wait_policy.wait(driver, "login_redirect", EC.url_contains("/home"))
+    except (TimeoutException, PageError) as e:
+        # A rejected or throttled login stays on the form; rest the account before it gets locked.
+        throttled = isinstance(e, PageError) and e.kind == "throttled"
+        account.cool_down("throttled" if throttled else "login_failed")
+        raise
+    account.mark_healthy()
+    logger.info(f"Login successful for {account.username}.")
+
+# Most recent failure screenshots, kept in memory for the admin /screenshots command.
+failure_screenshots = deque(maxlen=SCREENSHOT_BUFFER_SIZE)
+
+@metrics.timed_method("browser_stage")
+def capture_screenshot(driver) -> bytes:
+    """
+    Captures the viewport into memory as a downscaled JPEG through CDP, falling back
+    to a full-size PNG if the browser refuses the CDP call.
+    """
+    try:
+        width, height = driver.execute_script("return [window.innerWidth, window.innerHeight]")
+        data = driver.execute_cdp_cmd("Page.captureScreenshot", {
+            "format": "jpeg",
+            "quality": SCREENSHOT_JPEG_QUALITY,
+            "clip": {"x": 0, "y": 0, "width": width, "height": height, "scale": SCREENSHOT_SCALE},
+        })["data"]
+        return base64.b64decode(data)
+    except Exception:
+        return driver.get_screenshot_as_png()
+
+class ReviewResult:
+    """Outcome of one review flow; plain attributes so it crosses the worker pipe as a dict."""
+
+    def __init__(self, ok: bool, page_ready_seconds=None, screenshot=None, error=None):
+        self.ok = ok
+        self.page_ready_seconds = page_ready_seconds
+        self.screenshot = screenshot
+        self.error = error
+
+def run_chess_login_flow(driver, account: ChessAccount, game_url: str, on_stage=lambda stage: None, want_screenshot=False) -> ReviewResult:
+    """
+    Opens the review page on an already-running driver logged in as account.
+    Re-logs in only if the session has expired since the driver was warmed up.
+    Calls on_stage with each STAGE_PROGRESS key as the flow reaches it.
+    Never raises: failures come back as a ReviewResult with ok False and the
+    error text, and their screenshot is kept in failure_screenshots. The review
+    screenshot is only taken when want_screenshot is set.
+    """
+    logger.info("--- Starting Chess.com Review Flow ---")
+
+    if account is None:
+        logger.error("No chess.com account is configured. Please use /setconfig.")
+        return ReviewResult(False, error="no chess.com account configured")
+
+    try:
+        navigation_started = time.monotonic()
+        with metrics.timed("browser_stage", op="navigation"):
             driver.get(game_url)
 
-        # --- COMMON FINALIZATION LOGIC ---
-        logger.info("Waiting for final confirmation of analysis page...")
-        final_wait = WebDriverWait(driver, 20)
-        wait.until(EC.element_to_be_clickable((By.XPATH, "//span[text()='Start Review']")))
-        logger.info("Page confirmed. Taking screenshot.")
-        
-        driver.save_screenshot("new_tab_screenshot.png")
-        logger.info("Screenshot of analysis page saved as 'new_tab_screenshot.png'.")
+        # With page_load_strategy "none", get() returns before navigation commits, and the warm
+        # tab may still show the previous game's review button; only this game's page counts.
+        game_path = urlsplit(game_url).path
+
+        def on_this_game(driver):
+            return game_path in driver.current_url and EC.element_to_be_clickable((By.XPATH, START_REVIEW_BUTTON))(driver)
+
+        def review_or_login(driver):
+            # Whichever shows first: the review button (session alive) or a login form (session gone).
+            if "/login" in driver.current_url or driver.find_elements(By.ID, "login-username"):
+                return "login"
+            return "ready" if on_this_game(driver) else False
+
+        # A timeout here fails the review: a slow page is not an expired session, and
+        # logging in again would only add more waits and cool the account down.
+        state = wait_policy.wait(driver, "review_page", review_or_login)
+        if state == "ready":
+            logger.info("✅ Session is active. Analysis page loaded directly.")
+            on_stage("session_valid")
+        else:
+            # Session expired, so we re-authenticate.
+            logger.warning("Session expired on warm browser. Re-authenticating...")
+            on_stage("relogin")
+            metrics.inc("relogins", path="request")
+            login(driver, account)
+            logger.info("Re-authentication successful. Navigating back to game URL...")
+            on_stage("session_valid")
+            navigation_started = time.monotonic()
+            with metrics.timed("browser_stage", op="navigation"):
+                driver.get(game_url)
+            logger.info("Waiting for final confirmation of analysis page...")
+            wait_policy.wait(driver, "review_ready", on_this_game)
+
+        page_ready_seconds = time.monotonic() - navigation_started
+        logger.info(f"Page confirmed after {page_ready_seconds:.2f}s.")
+        on_stage("page_ready")
+
+        screenshot = None
+        if want_screenshot:
+            screenshot = capture_screenshot(driver)
+            logger.info(f"Captured review screenshot ({len(screenshot) / 1024:.0f} KB).")
+            on_stage("screenshot_captured")
+        return ReviewResult(True, page_ready_seconds, screenshot)
 
     except Exception as e:
         logger.error(f"An error occurred in the main process: {e}")
-        if driver:
-            driver.save_screenshot("error.png")
-            logger.info("Error screenshot saved as 'error.png'.")
-    
+        error = str(e).splitlines()[0] if str(e) else type(e).__name__
+        metrics.inc("review_failures", type=e.kind if isinstance(e, PageError) else type(e).__name__)
+        kind = e.kind if isinstance(e, PageError) else page_error_kind(driver)
+        if kind == "throttled" and account.available():
+            account.cool_down("throttled")
+        try:
+            failure_screenshots.append({
+                'at': time.time(),
+                'url': game_url,
+                'error': error,
+                'image': capture_screenshot(driver),
+            })
+            logger.info("Error screenshot kept in memory for /screenshots.")
+        except Exception:
+            pass
+        return ReviewResult(False, error=error)
     finally:
-        if driver:
-            logger.info("Closing WebDriver...")
-            driver.quit()
         logger.info("--- Chess.com Flow Finished ---")
+
+
+# --- Browser Pool ---
+
+def profile_path_for(account: ChessAccount, slot: int) -> str:
+    """
+    Each pool slot needs its own profile, since Chrome locks a user-data-dir to one process,
+    and keying it by account keeps one account's cookies out of another's browser.
+    """
+    return os.path.join(PROFILES_DIR, f"{account.username}_{slot}" if account else f"anonymous_{slot}")
+
+def process_tree_rss(pid: int) -> int:
+    """Returns the resident memory in bytes of a process and all its descendants (Linux only)."""
+    children = {}
+    try:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces, so split after the closing paren.
+                    fields = f.read().rsplit(")", 1)[1].split()
+                children.setdefault(int(fields[1]), []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    except OSError:
+        return 0
+
+    total, stack = 0, [pid]
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            pass
+        stack.extend(children.get(current, []))
+    return total
+
+
+class BrowserSession:
+    """
+    A long-lived Chrome instance that stays logged in to one account between reviews.
+    Lives inside a browser worker process; the supervisor talks to it through WorkerSession.
+    """
+
+    def __init__(self, slot: int, account: ChessAccount):
+        self.slot = slot
+        self.account = account
+        self.profile_path = profile_path_for(account, slot)
+        self.driver = None
+        self.uses = 0
+        self.started_at = None
+        self.cookies = []          # Snapshot of the browser's chess.com cookies for the session probe
+        self.user_agent = None
+        self.needs_login = False
+
+    def start(self):
+        """Launches Chrome and makes sure it is logged in. Blocking; run it in a thread."""
+        profile_exists = os.path.exists(self.profile_path) and os.listdir(self.profile_path)
+        try:
+            with metrics.timed("browser_stage", op="driver_startup"):
+                self.driver = create_driver(self.profile_path)
+            self.uses = 0
+            self.started_at = time.monotonic()
+
+            if self.account is None:
+                logger.warning(f"Browser slot {self.slot} started without credentials; login skipped.")
+                return
+
+            if profile_exists:
+                self.driver.get(f"{CHESS_BASE_URL}/home")
+                if "/login" not in self.driver.current_url:
+                    self.export_cookies()
+                    logger.info(f"✅ Browser slot {self.slot} warmed up with existing session.")
+                    return
+                logger.info(f"Browser slot {self.slot} profile session expired. Logging in...")
+            else:
+                logger.info(f"Browser slot {self.slot} has no profile. Performing clean initial login.")
+            login(self.driver, self.account)
+            self.export_cookies()
+            logger.info(f"✅ Browser slot {self.slot} warmed up as {self.account.username}.")
+        except Exception as e:
+            logger.error(f"❌ Browser slot {self.slot} failed to start: {e}")
+            self.close()
+
+    def close(self):
+        """Quits Chrome; the profile on disk is left for the ProfileMaintainer."""
+        if self.driver:
+            logger.info(f"Closing WebDriver for slot {self.slot}...")
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logger.warning(f"Error while quitting driver for slot {self.slot}: {e}")
+            self.driver = None
+
+    def restart(self):
+        self.close()
+        self.start()
+
+    def relogin(self):
+        """Logs the running browser in again, outside of any user's request."""
+        if self.driver is None:
+            self.start()
+            return
+        try:
+            metrics.inc("relogins", path="background")
+            login(self.driver, self.account)
+            self.export_cookies()
+            self.needs_login = False
+            logger.info(f"✅ Browser slot {self.slot} proactively re-logged in.")
+        except Exception as e:
+            logger.error(f"❌ Proactive re-login failed for slot {self.slot}: {e}")
+
+    def export_cookies(self):
+        """Copies the browser's cookies out so the session can be probed over plain HTTP."""
+        self.cookies = self.driver.get_cookies()
+        self.user_agent = self.driver.execute_script("return navigator.userAgent")
+        self.needs_login = False
+
+    def rss_bytes(self) -> int:
+        try:
+            return process_tree_rss(self.driver.service.process.pid)
+        except Exception:
+            return 0
+
+    def is_usable(self) -> bool:
+        """Health check: the browser answers, and it is under its use and memory budget."""
+        if self.driver is None:
+            return False
+        try:
+            self.driver.current_url
+        except Exception:
+            logger.warning(f"Browser slot {self.slot} is unresponsive.")
+            return False
+        if self.uses >= BROWSER_MAX_USES:
+            logger.info(f"Browser slot {self.slot} reached {self.uses} uses; recycling.")
+            return False
+        rss_mb = self.rss_bytes() / (1024 * 1024)
+        if rss_mb > BROWSER_MAX_RSS_MB:
+            logger.info(f"Browser slot {self.slot} is using {rss_mb:.0f} MB; recycling.")
+            return False
+        return True
+
+
+# --- Browser Worker Processes ---
+
+# Workers are spawned, not forked: the supervisor has an event loop and threads running.
+worker_context = multiprocessing.get_context("spawn")
+
+class WorkerTimeoutError(RuntimeError):
+    """A worker did not answer within its deadline and was killed."""
+
+
+class WorkerAccount(ChessAccount):
+    """
+    A worker's copy of its account. Health changes are reported to the supervisor,
+    which owns the account's state across every slot that uses it.
+    """
+
+    def __init__(self, username: str, password: str, report):
+        super().__init__(username, password)
+        self._report = report
+
+    def cool_down(self, reason: str):
+        self._report(("account", "cool_down", reason))
+
+    def mark_healthy(self):
+        self._report(("account", "healthy"))
+
+
+def browser_worker_main(conn, slot: int, username, password, chromedriver_path: str):
+    """
+    Entry point of a browser worker process. Owns one BrowserSession and serves
+    commands from the supervisor over conn until told to close or the pipe breaks.
+    Metrics, stage events and failure screenshots are forwarded to the supervisor.
+    """
+    global CHROMEDRIVER_PATH
+    # Own process group, so the supervisor can kill Chrome and ChromeDriver along with us.
+    os.setsid()
+    CHROMEDRIVER_PATH = chromedriver_path
+    load_browser_stack()
+    metrics.forward_to(conn.send)
+
+    account = WorkerAccount(username, password, conn.send) if username else None
+    session = BrowserSession(slot, account)
+
+    def state():
+        return {
+            'alive': session.driver is not None,
+            'cookies': session.cookies,
+            'user_agent': session.user_agent,
+            'needs_login': session.needs_login,
+        }
+
+    while True:
+        try:
+            command, args = conn.recv()
+        except (EOFError, OSError):
+            command, args = "close", ()  # Supervisor is gone
+
+        if command == "close":
+            session.close()
+            return
+        result = None
+        if command == "start":
+            session.restart()
+        elif command == "relogin":
+            session.relogin()
+        elif command == "usable":
+            result = session.is_usable()
+        elif command == "review":
+            game_url, want_screenshot = args
+            outcome = run_chess_login_flow(
+                session.driver, account, game_url, lambda stage: conn.send(("stage", stage)), want_screenshot
+            )
+            result = vars(outcome)
+            while failure_screenshots:
+                conn.send(("failure", failure_screenshots.popleft()))
+            try:
+                session.export_cookies()
+            except Exception as e:
+                logger.warning(f"Could not export cookies for slot {slot}: {e}")
+        conn.send(("done", state(), result))
+
+
+class WorkerSession:
+    """
+    Supervisor-side handle for one browser worker process. Exposes the same
+    blocking lifecycle calls the pool used to make on in-process sessions, but every
+    call has a hard deadline: a worker that misses it is killed together with its
+    browser, and the next start() respawns it.
+    """
+
+    def __init__(self, slot: int, account: ChessAccount):
+        self.slot = slot
+        self.account = account
+        self.profile_path = profile_path_for(account, slot)
+        self.process = None
+        self.conn = None
+        self.alive = False
+        self.uses = 0
+        self.started_at = None
+        self.cookies = []          # Snapshot of the browser's chess.com cookies for the session probe
+        self.user_agent = None
+        self.needs_login = False
+        self._lock = threading.Lock()
+
+    def _spawn_process(self):
+        self.conn, child_conn = worker_context.Pipe()
+        self.process = worker_context.Process(
+            target=browser_worker_main,
+            args=(child_conn, self.slot, self.account.username if self.account else None,
+                  self.account.password if self.account else None, CHROMEDRIVER_PATH),
+            name=f"browser-worker-{self.slot}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        logger.info(f"Spawned browser worker for slot {self.slot} (pid {self.process.pid}).")
+
+    def _call(self, command: str, args=(), timeout: float = WORKER_COMMAND_TIMEOUT, on_stage=lambda stage: None):
+        """Sends one command and waits for its reply, applying forwarded events as they arrive."""
+        with self._lock:
+            if self.process is None or not self.process.is_alive():
+                raise RuntimeError(f"Browser worker for slot {self.slot} is not running.")
+            deadline = time.monotonic() + timeout
+            try:
+                self.conn.send((command, args))
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self.conn.poll(remaining):
+                        metrics.inc("worker_kills", reason="timeout", command=command)
+                        self.kill()
+                        raise WorkerTimeoutError(f"Browser worker for slot {self.slot} timed out after {timeout:.0f}s on {command}.")
+                    kind, *payload = self.conn.recv()
+                    if kind == "done":
+                        self._apply(payload[0])
+                        return payload[1]
+                    if kind == "stage":
+                        on_stage(payload[0])
+                    elif kind == "observe":
+                        name, seconds, labels = payload
+                        metrics.observe(name, seconds, **labels)
+                    elif kind == "inc":
+                        name, amount, labels = payload
+                        metrics.inc(name, amount, **labels)
+                    elif kind == "failure":
+                        failure_screenshots.append(payload[0])
+                    elif kind == "account" and self.account:
+                        self._account_event(*payload)
+            except (EOFError, OSError) as e:
+                metrics.inc("worker_kills", reason="crashed", command=command)
+                self.kill()
+                raise RuntimeError(f"Browser worker for slot {self.slot} died during {command}.") from e
+
+    def _apply(self, state: dict):
+        self.alive = state['alive']
+        self.cookies = state['cookies']
+        self.user_agent = state['user_agent']
+        self.needs_login = state['needs_login']
+
+    def _account_event(self, event: str, reason: str = None):
+        """Applies a worker's health report to the shared account."""
+        if event == "cool_down":
+            # Other slots may report the same throttle; one cooldown covers them all.
+            if self.account.available():
+                self.account.cool_down(reason)
+        elif event == "healthy":
+            self.account.mark_healthy()
+
+    def kill(self):
+        """Hard-stops the worker and everything it launched."""
+        if self.process is not None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                self.process.kill()
+            self.process.join(5)
+            logger.warning(f"Killed browser worker for slot {self.slot} (pid {self.process.pid}).")
+        if self.conn is not None:
+            self.conn.close()
+        self.process = self.conn = None
+        self.alive = False
+
+    def start(self):
+        """Spawns the worker process and has it launch and log in its browser. Blocking."""
+        if self.process is None or not self.process.is_alive():
+            self._spawn_process()
+        self.uses = 0
+        self.started_at = time.monotonic()
+        try:
+            self._call("start", timeout=WORKER_STARTUP_TIMEOUT)
+        except RuntimeError as e:
+            logger.error(f"❌ Browser slot {self.slot} failed to start: {e}")
+
+    def close(self):
+        """Asks the worker to quit its browser and exit, killing it if it does not."""
+        if self.process is None:
+            return
+        logger.info(f"Closing browser worker for slot {self.slot}...")
+        try:
+            with self._lock:
+                self.conn.send(("close", ()))
+            self.process.join(WORKER_COMMAND_TIMEOUT)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+            self.process = self.conn = None
+            self.alive = False
+
+    def restart(self):
+        self.close()
+        self.start()
+
+    def relogin(self):
+        """Logs the running browser in again, outside of any user's request."""
+        if not self.alive:
+            self.restart()
+            return
+        try:
+            self._call("relogin", timeout=WORKER_STARTUP_TIMEOUT)
+        except RuntimeError as e:
+            logger.error(f"❌ Proactive re-login failed for slot {self.slot}: {e}")
+
+    def review(self, game_url: str, on_stage=lambda stage: None, want_screenshot=False) -> ReviewResult:
+        """Runs the review flow in the worker under REVIEW_JOB_TIMEOUT and records its page-ready time and RSS."""
+        result = ReviewResult(**self._call("review", (game_url, want_screenshot), timeout=REVIEW_JOB_TIMEOUT, on_stage=on_stage))
+        record_review_measurement(self, result.page_ready_seconds)
+        return result
+
+    def rss_bytes(self) -> int:
+        """Memory of the whole worker: the Python process, ChromeDriver and every Chrome process."""
+        return process_tree_rss(self.process.pid) if self.process is not None else 0
+
+    def over_memory(self) -> bool:
+        rss_mb = self.rss_bytes() / (1024 * 1024)
+        if rss_mb > BROWSER_MAX_RSS_MB:
+            logger.info(f"Browser worker for slot {self.slot} is using {rss_mb:.0f} MB; recycling.")
+            return True
+        return False
+
+    def is_usable(self) -> bool:
+        """Health check: the worker answers, its browser is responsive, and it is under budget."""
+        if not self.alive or self.over_memory():
+            return False
+        try:
+            return self._call("usable")
+        except RuntimeError as e:
+            logger.warning(f"Browser slot {self.slot} health check failed: {e}")
+            return False
+
+
+class BrowserPool:
+    """
+    Keeps BROWSER_POOL_SIZE warm, logged-in browser sessions and hands them out
+    with lease/return semantics, so Chrome cold start is paid once per slot
+    instead of once per review. Slots are spread round-robin over the configured
+    accounts and leases go to the least busy account that is not cooling down.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.sessions = []
+        self._idle = deque()
+        self._available = asyncio.Condition()
+        self._background = set()  # Keeps references to recycle/warm-up tasks until they finish
+        self.ready = asyncio.Event()  # Set once every slot has been through its first warm-up
+        # Blocking worker calls get their own threads, one per slot, so long reviews can't
+        # starve each other, health checks or restarts in the loop's small default executor.
+        self._executor = ThreadPoolExecutor(max_workers=max(1, size), thread_name_prefix="browser-pool")
+
+    async def run(self, func, *args):
+        """Runs a blocking WorkerSession call on the pool's own threads."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def put(self, session: WorkerSession):
+        async with self._available:
+            self._idle.append(session)
+            self._available.notify()
+
+    def _assign(self):
+        """(Re)binds every slot to an account from account_pool."""
+        accounts = account_pool.accounts
+        if len(accounts) > self.size:
+            logger.warning(f"{len(accounts)} accounts configured but only {self.size} browser slot(s); "
+                           f"raise BROWSER_POOL_SIZE to use them all.")
+        self.sessions = [WorkerSession(slot, account_pool.assign(slot)) for slot in range(self.size)]
+
+    def _pick(self, any_account: bool):
+        def load(session):
+            account = session.account
+            return (account.active_jobs, account.last_used) if account else (0, 0.0)
+        candidates = [s for s in self._idle if any_account or s.account is None or s.account.available()]
+        return min(candidates, key=load) if candidates else None
+
+    async def _get(self, any_account=False) -> WorkerSession:
+        """
+        Takes the idle session whose account is least busy (then least recently used),
+        skipping accounts that are cooling down unless any_account is set.
+        """
+        async with self._available:
+            while (session := self._pick(any_account)) is None:
+                timeout = None
+                if self._idle:
+                    # Only cooling-down accounts are idle; wake up when the first one is back.
+                    timeout = max(min(s.account.cooldown_until for s in self._idle) - time.time(), 0.1)
+                try:
+                    await asyncio.wait_for(self._available.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self._idle.remove(session)
+            return session
+
+    def take_if_idle(self, session: WorkerSession) -> bool:
+        """Removes a specific session from the idle set for maintenance; False if it is busy."""
+        try:
+            self._idle.remove(session)
+            return True
+        except ValueError:
+            return False
+
+    async def start(self):
+        """Warms up every slot concurrently. Sessions become leasable as soon as each is ready."""
+        self._assign()
+        logger.info(f"Warming up browser pool with {len(self.sessions)} session(s) over {len(account_pool.accounts)} account(s)...")
+        await asyncio.gather(*(self._warm(session) for session in self.sessions))
+        self.ready.set()
+
+    async def _warm(self, session: WorkerSession, restart=False):
+        await self.run(session.restart if restart else session.start)
+        await self.put(session)
+
+    async def relogin(self, session: WorkerSession):
+        """Re-logs a session taken out of rotation and returns it to the pool."""
+        await self.run(session.relogin)
+        await self.put(session)
+
+    async def acquire(self) -> WorkerSession:
+        with metrics.timed("pool_wait"):
+            session = await self._get()
+        try:
+            if not await self.run(session.is_usable):
+                await self.run(session.restart)
+        except BaseException:
+            await self.put(session)
+            raise
+        if not session.alive:
+            await self.put(session)
+            raise RuntimeError(f"Browser slot {session.slot} could not be started.")
+        if session.account:
+            session.account.active_jobs += 1
+            session.account.last_used = time.time()
+        return session
+
+    async def release(self, session: WorkerSession):
+        if session.account:
+            session.account.active_jobs -= 1
+        session.uses += 1
+        if session.uses >= BROWSER_MAX_USES or not session.alive or await self.run(session.over_memory):
+            # Recycle (or respawn a killed worker) off the request path; the slot rejoins the pool once it is warm again.
+            self._spawn(self._warm(session, restart=True))
+        elif session.needs_login:
+            # The session probe found this login stale while it was busy; refresh it before reuse.
+            self._spawn(self.relogin(session))
+        else:
+            await self.put(session)
+
+    @asynccontextmanager
+    async def lease(self):
+        session = await self.acquire()
+        try:
+            yield session
+        finally:
+            await self.release(session)
+
+    async def reset(self, wipe=False):
+        """
+        Takes every session out of rotation and closes it, rebinds the slots to the
+        current account list and warms them up again in the background (used after
+        /setconfig). Profiles of accounts that are gone are deleted; wipe deletes all.
+        """
+        drained = [await self._get(any_account=True) for _ in self.sessions]
+        for session in drained:
+            await self.run(session.close)
+        self._assign()
+        keep = set() if wipe else {session.profile_path for session in self.sessions}
+        if os.path.isdir(PROFILES_DIR):
+            for entry in os.listdir(PROFILES_DIR):
+                path = os.path.join(PROFILES_DIR, entry)
+                if path not in keep:
+                    await asyncio.to_thread(shutil.rmtree, path, True)
+                    logger.info(f"Removed old chrome profile at: {path}")
+        for session in self.sessions:
+            self._spawn(self._warm(session))
+
+    async def shutdown(self):
+        for session in self.sessions:
+            await self.run(session.close)
+        self._executor.shutdown(wait=False)
+
+
+browser_pool = BrowserPool(BROWSER_POOL_SIZE)
+
+# --- Session Manager ---
+
+class SessionManager:
+    """
+    Checks each browser's chess.com login over plain HTTP using its exported cookies,
+    and re-logs browsers in the background when the login is gone or about to expire,
+    so users never pay for a re-login inside their own request.
+    """
+
+    def __init__(self, pool: BrowserPool, interval: float, refresh_margin: float):
+        self.pool = pool
+        self.interval = interval
+        self.refresh_margin = refresh_margin
+        self.client = httpx.AsyncClient(
+            timeout=10,
+            follow_redirects=False,
+            limits=httpx.Limits(max_keepalive_connections=BROWSER_POOL_SIZE),
+        )
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.client.aclose()
+
+    async def probe(self, session: WorkerSession):
+        """
+        Returns True if chess.com still treats the cookies as logged in, False if it
+        redirects to the login page, and None when the answer is inconclusive
+        (network error or bot protection), in which case nothing is changed.
+        """
+        site = httpx.URL(CHESS_BASE_URL).host.removeprefix("www.")
+        cookies = {c['name']: c['value'] for c in session.cookies if c.get('domain', '').lstrip('.').endswith(site)}
+        if not cookies:
+            return None
+        headers = {'User-Agent': session.user_agent} if session.user_agent else {}
+        try:
+            response = await self.client.get(SESSION_PROBE_URL, cookies=cookies, headers=headers)
+        except httpx.HTTPError as e:
+            logger.warning(f"Session probe for slot {session.slot} failed: {e}")
+            return None
+        if response.status_code == 200:
+            return True
+        if response.is_redirect and "/login" in response.headers.get("location", ""):
+            return False
+        return None
+
+    def expires_soon(self, session: WorkerSession) -> bool:
+        expiries = [c['expiry'] for c in session.cookies if c['name'] in SESSION_COOKIE_NAMES and 'expiry' in c]
+        return bool(expiries) and min(expiries) - time.time() < self.refresh_margin
+
+    async def check(self, session: WorkerSession):
+        if not session.alive:
+            return
+        if self.expires_soon(session):
+            logger.info(f"Login for slot {session.slot} expires soon; refreshing in the background.")
+        elif await self.probe(session) is not False:
+            return
+        else:
+            logger.info(f"Login for slot {session.slot} is no longer valid; refreshing in the background.")
+
+        if self.pool.take_if_idle(session):
+            await self.pool.relogin(session)
+        else:
+            # Busy right now; the pool re-logs it in as soon as it is returned.
+            session.needs_login = True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for session in self.pool.sessions:
+                try:
+                    await self.check(session)
+                except Exception as e:
+                    logger.error(f"Session check for slot {session.slot} failed: {e}")
+
+
+session_manager = SessionManager(browser_pool, SESSION_PROBE_INTERVAL, SESSION_REFRESH_MARGIN_HOURS * 3600)
+
+
+# --- Profile Maintainer ---
+
+class ProfileMaintainer:
+    """
+    Watches each browser profile off the request path. When a profile grows past
+    PROFILE_MAX_MB it prunes cache files in place down to PROFILE_TARGET_MB, and
+    cache files older than PROFILE_CACHE_MAX_AGE_HOURS are dropped once per that
+    period. A session is only pruned while it is idle, never mid-review.
+    """
+
+    def __init__(self, pool: BrowserPool, max_bytes: int, target_bytes: int, max_age: float, interval: float):
+        self.pool = pool
+        self.max_bytes = max_bytes
+        self.target_bytes = target_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.last_pruned = {}          # slot -> time.time() of the last age-based prune
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def check(self, session: WorkerSession):
+        if not os.path.exists(session.profile_path):
+            return
+        size = await asyncio.to_thread(directory_size, session.profile_path)
+        age_due = time.time() - self.last_pruned.setdefault(session.slot, time.time()) >= self.max_age
+        if size <= self.max_bytes and not age_due:
+            return
+        if not self.pool.take_if_idle(session):
+            return  # Busy; the next round will get it
+
+        try:
+            target = self.target_bytes if size > self.max_bytes else size
+            reclaimed, seconds = await asyncio.to_thread(
+                prune_chrome_profile, session.profile_path, target, self.max_age
+            )
+        finally:
+            await self.pool.put(session)
+
+        self.last_pruned[session.slot] = time.time()
+        metrics.observe("browser_stage", seconds, op="profile_prune")
+        metrics.inc("profile_bytes_reclaimed", reclaimed)
+        logger.info(
+            f"🧹 Pruned profile for slot {session.slot}: {size / 2**20:.1f} MB -> "
+            f"{(size - reclaimed) / 2**20:.1f} MB, reclaimed {reclaimed / 2**20:.1f} MB in {seconds:.2f}s."
+        )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for session in self.pool.sessions:
+                try:
+                    await self.check(session)
+                except Exception as e:
+                    logger.error(f"Profile maintenance for slot {session.slot} failed: {e}")
+
+
+profile_maintainer = ProfileMaintainer(
+    browser_pool,
+    PROFILE_MAX_MB * 2**20,
+    PROFILE_TARGET_MB * 2**20,
+    PROFILE_CACHE_MAX_AGE_HOURS * 3600,
+    PROFILE_CHECK_INTERVAL,
+)
+
+
+# Recent (mode, page_ready_seconds, rss_bytes) samples so lean and full mode can be compared.
+review_measurements = deque(maxlen=200)
+
+def record_review_measurement(session: WorkerSession, page_ready_seconds):
+    """Logs page-ready time and browser RSS for one review, plus the rolling median for this mode."""
+    if page_ready_seconds is None:
+        return
+    rss = session.rss_bytes()
+    review_measurements.append((BROWSER_MODE, page_ready_seconds, rss))
+    samples = [m for m in list(review_measurements) if m[0] == BROWSER_MODE]
+    median_ready = statistics.median(m[1] for m in samples)
+    median_rss = statistics.median(m[2] for m in samples)
+    logger.info(
+        f"📏 Slot {session.slot} ({BROWSER_MODE} mode): page ready in {page_ready_seconds:.2f}s, "
+        f"browser RSS {rss / 2**20:.0f} MB. Median over {len(samples)}: "
+        f"{median_ready:.2f}s, {median_rss / 2**20:.0f} MB."
+    )
+
+async def run_review(game_url: str, on_stage=lambda stage: None, want_screenshot=False):
+    """
+    Leases a warm browser worker from the pool and runs the review flow in it.
+    Only the wait for the worker's reply occupies a pool thread here; stage events it
+    forwards are delivered on the event loop. Returns the in-memory screenshot if
+    one was requested; raises ReviewFailedError if the flow did not reach the review
+    page, or WorkerTimeoutError if the worker had to be killed.
+    """
+    loop = asyncio.get_running_loop()
+
+    def report_from_thread(stage):
+        loop.call_soon_threadsafe(on_stage, stage)
+
+    async with browser_pool.lease() as session:
+        on_stage("driver_acquired")
+        result = await browser_pool.run(session.review, game_url, report_from_thread, want_screenshot)
+    if not result.ok:
+        raise ReviewFailedError(result.error)
+    return result.screenshot
+
+# --- Review Scheduler ---
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be queued; the message is safe to show to the user."""
+
+
+class ReviewFailedError(Exception):
+    """The review flow ran but did not get the review page ready."""
+
+
+class ReviewJob:
+    """A queued review request and the future its submitter awaits."""
+
+    def __init__(self, user_id: int, game_id: str, want_screenshot=False):
+        self.user_id = user_id
+        self.game_id = game_id
+        self.game_url = analysis_url_for(game_id)
+        self.want_screenshot = want_screenshot
+        self.future = asyncio.get_running_loop().create_future()
+        self.started = asyncio.Event()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.position = None
+        self.position_changed = asyncio.Event()
+        self.stage = "queued"
+        self.stage_changed = asyncio.Event()
+        self.attempts = 0
+
+    def report_stage(self, stage: str):
+        self.stage = stage
+        self.stage_changed.set()
+
+
+class RemoteLease:
+    """A job handed to a worker node, kept only while the node keeps heartbeating."""
+
+    def __init__(self, job: ReviewJob, node: str):
+        self.job = job
+        self.node = node
+        self.expires_at = time.monotonic() + BROKER_LEASE_SECONDS
+
+
+class ReviewScheduler:
+    """
+    Bounded job queue in front of the browser pool. One worker runs per pool slot,
+    jobs are taken round-robin across users so no single user can hog the workers,
+    and each user may only have REVIEW_MAX_PER_USER jobs queued or running at once.
+    """
+
+    def __init__(self, workers: int, max_queue: int, max_per_user: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self._queues = {}            # user_id -> deque of jobs; dict order is the round-robin rotation
+        self._pending = 0
+        self._running = 0
+        self._per_user = {}          # user_id -> jobs queued or running
+        self._paused = False
+        self._cond = asyncio.Condition()
+        self._worker_tasks = []
+        self._leases = {}            # token -> RemoteLease held by a worker node
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def start(self):
+        self._worker_tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        self._worker_tasks.append(asyncio.create_task(self._reap()))
+        logger.info(f"Review scheduler started with {self.workers} local worker(s).")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+
+    async def submit(self, user_id: int, game_id: str, want_screenshot=False) -> ReviewJob:
+        return (await self.submit_batch(user_id, [game_id], want_screenshot))[0]
+
+    async def submit_batch(self, user_id: int, game_ids: list, want_screenshot=False) -> list:
+        """
+        Queues every game as its own job, or none of them if the whole batch does not fit.
+        Workers close each job in the journal when it ends, refunding failed ones.
+        """
+        count = len(game_ids)
+        if self._pending + count > self.max_queue:
+            metrics.inc("queue_rejections", reason="queue_full")
+            raise QueueFullError("⏳ The bot is busy right now, please try again in a few minutes.")
+        if self._per_user.get(user_id, 0) + count > self.max_per_user:
+            metrics.inc("queue_rejections", reason="per_user_limit")
+            if count > 1:
+                raise QueueFullError(f"⏳ You can have at most {self.max_per_user} reviews in progress, please send fewer links.")
+            raise QueueFullError("⏳ You already have reviews in progress, please wait for them to finish.")
+
+        jobs = [ReviewJob(user_id, game_id, want_screenshot) for game_id in game_ids]
+        self._queues.setdefault(user_id, deque()).extend(jobs)
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + count
+        self._pending += count
+        self._publish_positions()
+        async with self._cond:
+            self._cond.notify(count)
+        return jobs
+
+    def _pop_next(self) -> ReviewJob:
+        user_id = next(iter(self._queues))
+        user_queue = self._queues.pop(user_id)
+        job = user_queue.popleft()
+        if user_queue:
+            self._queues[user_id] = user_queue  # Re-inserting moves the user to the back of the rotation
+        self._pending -= 1
+        return job
+
+    def _publish_positions(self):
+        """Recomputes every waiting job's 1-based position in the round-robin dispatch order."""
+        lanes = [list(q) for q in self._queues.values()]
+        position = 0
+        for depth in range(max((len(lane) for lane in lanes), default=0)):
+            for lane in lanes:
+                if depth < len(lane):
+                    position += 1
+                    job = lane[depth]
+                    if job.position != position:
+                        job.position = position
+                        job.position_changed.set()
+
+    async def _take(self) -> ReviewJob:
+        """Waits for the next job in round-robin order and marks it started."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._pending and not self._paused)
+            job = self._pop_next()
+            self._running += 1
+        self._publish_positions()
+        job.attempts += 1
+        job.started_at = time.monotonic()
+        metrics.observe("queue_wait", job.started_at - job.submitted_at)
+        job.started.set()
+        credit_store.mark_job_running(job.user_id, job.game_id)
+        return job
+
+    async def _settle(self, job: ReviewJob, result=None, error: Exception = None):
+        """Closes a running job in the journal, resolves its future and frees its slot."""
+        self._resolve(job, result, error)
+        async with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def _resolve(self, job: ReviewJob, result=None, error: Exception = None):
+        if error is None:
+            credit_store.finish_job(job.user_id, job.game_id, ok=True)
+            if not job.future.done():
+                job.future.set_result(result)
+        else:
+            credit_store.finish_job(job.user_id, job.game_id, ok=False, error=str(error) or type(error).__name__)
+            if not job.future.done():
+                job.future.set_exception(error)
+        job.finished_at = time.monotonic()
+        self._per_user[job.user_id] -= 1
+        if not self._per_user[job.user_id]:
+            del self._per_user[job.user_id]
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self._take()
+            logger.info(f"Worker {worker_id} picked up a job for user {job.user_id}.")
+            try:
+                with metrics.timed("review_total"):
+                    result = await run_review(job.game_url, job.report_stage, job.want_screenshot)
+            except Exception as e:
+                await self._settle(job, error=e)
+            else:
+                await self._settle(job, result)
+
+    @property
+    def leases(self) -> dict:
+        """Remote node name -> number of jobs it currently holds."""
+        counts = {}
+        for lease in self._leases.values():
+            counts[lease.node] = counts.get(lease.node, 0) + 1
+        return counts
+
+    async def lease(self, node: str, wait: float):
+        """
+        Hands the next job to a remote worker node, waiting up to `wait` seconds for one.
+        Returns (token, job) or None. The node must heartbeat before the lease expires.
+        """
+        try:
+            job = await asyncio.wait_for(self._take(), wait)
+        except asyncio.TimeoutError:
+            return None
+        token = secrets.token_hex(16)
+        self._leases[token] = RemoteLease(job, node)
+        job.report_stage("leased")
+        logger.info(f"Node {node} leased a job for user {job.user_id} (attempt {job.attempts}).")
+        return token, job
+
+    def heartbeat(self, token: str, stage: str = None) -> bool:
+        """Extends a lease and relays the node's current stage. False if the lease was lost."""
+        lease = self._leases.get(token)
+        if lease is None:
+            return False
+        lease.expires_at = time.monotonic() + BROKER_LEASE_SECONDS
+        if stage in STAGE_PROGRESS and stage != lease.job.stage:
+            lease.job.report_stage(stage)
+        return True
+
+    async def release(self, token: str) -> bool:
+        """Puts back a job whose lease never reached its node, without counting it as an attempt."""
+        lease = self._leases.pop(token, None)
+        if lease is None:
+            return False
+        logger.info(f"Node {lease.node} disconnected before receiving its job; requeueing it.")
+        lease.job.attempts -= 1
+        await self._requeue(lease.job)
+        return True
+
+    async def complete(self, token: str, ok: bool, screenshot=None, error: str = None) -> bool:
+        """Settles a leased job with the result a node posted. False if the lease was lost."""
+        lease = self._leases.pop(token, None)
+        if lease is None:
+            return False
+        metrics.observe("review_total", time.monotonic() - lease.job.started_at)
+        if ok:
+            await self._settle(lease.job, screenshot)
+        else:
+            await self._settle(lease.job, error=ReviewFailedError(error or "review failed on worker node"))
+        return True
+
+    async def _requeue(self, job: ReviewJob):
+        """Returns a running job to the front of its user's queue."""
+        job.report_stage("queued")
+        async with self._cond:
+            self._queues.setdefault(job.user_id, deque()).appendleft(job)
+            self._pending += 1
+            self._running -= 1
+            self._cond.notify()
+        self._publish_positions()
+
+    def _expire_waiting(self):
+        """Fails jobs that were never picked up within REVIEW_MAX_QUEUE_WAIT; the journal refunds them."""
+        cutoff = time.monotonic() - REVIEW_MAX_QUEUE_WAIT
+        expired = []
+        for user_id, user_queue in list(self._queues.items()):
+            stale = [job for job in user_queue if not job.started.is_set() and job.submitted_at < cutoff]
+            for job in stale:
+                user_queue.remove(job)
+            if not user_queue:
+                del self._queues[user_id]
+            expired.extend(stale)
+        if not expired:
+            return
+        self._pending -= len(expired)
+        logger.warning(f"{len(expired)} job(s) waited over {REVIEW_MAX_QUEUE_WAIT:.0f}s without a free worker; failing them.")
+        for job in expired:
+            metrics.inc("queue_rejections", reason="queue_timeout")
+            self._resolve(job, error=ReviewFailedError("no worker became free in time"))
+        self._publish_positions()
+
+    async def _reap(self):
+        """
+        Requeues jobs whose node stopped heartbeating, giving up after BROKER_MAX_ATTEMPTS,
+        and fails jobs that have waited longer than REVIEW_MAX_QUEUE_WAIT.
+        """
+        while True:
+            await asyncio.sleep(BROKER_HEARTBEAT_SECONDS)
+            if REVIEW_MAX_QUEUE_WAIT:
+                self._expire_waiting()
+            now = time.monotonic()
+            for token, lease in list(self._leases.items()):
+                if lease.expires_at > now:
+                    continue
+                del self._leases[token]
+                job = lease.job
+                metrics.inc("lease_expired", node=lease.node)
+                if job.attempts >= BROKER_MAX_ATTEMPTS:
+                    logger.error(f"Job for user {job.user_id} lost by {job.attempts} node(s), giving up.")
+                    await self._settle(job, error=ReviewFailedError("worker nodes stopped responding"))
+                    continue
+                logger.warning(f"Lease held by node {lease.node} expired, requeueing job for user {job.user_id}.")
+                await self._requeue(job)
+
+    @asynccontextmanager
+    async def paused(self):
+        """Stops dispatching and waits for running jobs to finish, e.g. while credentials change."""
+        async with self._cond:
+            self._paused = True
+            await self._cond.wait_for(lambda: self._running == 0)
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._paused = False
+                self._cond.notify_all()
+
+
+# A front-end runs no browsers of its own; worker nodes lease its jobs over the broker instead.
+review_scheduler = ReviewScheduler(0 if BOT_ROLE == "frontend" else BROWSER_POOL_SIZE, REVIEW_QUEUE_SIZE, REVIEW_MAX_PER_USER)
+
+# Pipeline stages reported by the review flow: (step out of REVIEW_STEPS, label)
+STAGE_PROGRESS = {
+    "queued": (0, "Waiting for a free browser"),
+    "leased": (0, "Sent to a review node"),
+    "driver_acquired": (1, "Browser ready"),
+    "relogin": (1, "Session expired, logging in again"),
+    "session_valid": (2, "Session verified"),
+    "page_ready": (3, "Review page ready"),
+    "screenshot_captured": (4, "Review captured"),
+}
+REVIEW_STEPS = 4
+
+def progress_text(job: ReviewJob) -> str:
+    """MarkdownV2 status text for the job's current queue position or pipeline stage."""
+    if not job.started.is_set():
+        return f"⏳ You are \\#{job.position} in the queue\\.\\.\\."
+    step, label = STAGE_PROGRESS[job.stage]
+    filled = round(10 * step / REVIEW_STEPS)
+    progress_bar = "█" * filled + "░" * (10 - filled)
+    return f"*Analyzing your game\\.\\.\\.*\n\n`{progress_bar}` {escape_markdown(label, version=2)}"
+
+async def follow_progress(job: ReviewJob, status_message):
+    """
+    Mirrors queue position and stage transitions into the status message until the
+    job finishes. Edits are at least PROGRESS_EDIT_INTERVAL apart; changes arriving
+    in between are coalesced so only the latest state is sent.
+    """
+    loop = asyncio.get_running_loop()
+    last_text, last_edit = None, float("-inf")
+    while not job.future.done():
+        job.position_changed.clear()
+        job.stage_changed.clear()
+        text = progress_text(job)
+        timeout = None
+        if text != last_text:
+            delay = last_edit + PROGRESS_EDIT_INTERVAL - loop.time()
+            if delay <= 0:
+                try:
+                    await outbox.edit(status_message, text, parse_mode='MarkdownV2')
+                except Exception: # Ignore potential "message is not modified" error
+                    pass
+                last_text, last_edit = text, loop.time()
+                continue
+            timeout = delay
+
+        waiters = [asyncio.create_task(job.position_changed.wait()), asyncio.create_task(job.stage_changed.wait())]
+        await asyncio.wait([job.future, *waiters], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for waiter in waiters:
+            waiter.cancel()
+
+
+# --- Engine Analysis ---
+
+# Filled in by load_engine_stack(); python-chess is only imported when ENGINE_PATH is set.
+chess = None
+
+def load_engine_stack():
+    """Imports python-chess and its PGN and engine modules into module globals."""
+    global chess
+    import chess
+    import chess.pgn
+    import chess.engine
+
+# Move text as it appears in a pasted PGN: "1. e4", "1.d4", "1. O-O"...
+PGN_MOVES_PATTERN = re.compile(r"(?:^|\s)1\.\s*(?:[KQRBN]?[a-h]?[1-8]?x?[a-h][1-8]|O-O)")
+
+# Losses in win percentage (0-100, from the mover's side) at which a move is flagged.
+MOVE_LABELS = ((15, "blunders", "??"), (10, "mistakes", "?"), (5, "inaccuracies", "?!"))
+MATE_SCORE = 10000
+
+def win_percent(centipawns: int) -> float:
+    """Expected score in percent for an evaluation, on the curve Lichess fitted to rated games."""
+    return 50 + 50 * (2 / (1 + math.exp(-0.00368208 * centipawns)) - 1)
+
+def move_accuracy(win_loss: float) -> float:
+    return min(100.0, max(0.0, 103.1668 * math.exp(-0.04354 * win_loss) - 3.1669))
+
+def looks_like_pgn(text: str) -> bool:
+    return bool(text) and PGN_MOVES_PATTERN.search(text) is not None
+
+def parse_pgn_games(text: str, limit: int) -> list:
+    """Reads up to `limit` games that have at least one move from PGN text."""
+    games, stream = [], io.StringIO(text)
+    while len(games) < limit:
+        game = chess.pgn.read_game(stream)
+        if game is None:
+            break
+        if game.errors:
+            logger.info(f"PGN parser skipped problems: {game.errors[0]}")
+        if next(iter(game.mainline_moves()), None) is not None:
+            games.append(game)
+    return games
+
+
+class EngineUnavailableError(RuntimeError):
+    """Every engine process is gone and none has been restarted yet."""
+
+
+class EnginePool:
+    """
+    ENGINE_POOL_SIZE persistent UCI engine processes. Positions are leased to
+    whichever engine is free, so one game's positions are searched in parallel
+    across cores; an engine that crashes or hangs is replaced, and one that cannot
+    be restarted right away is retried in the background with backoff. Games are
+    admitted up to max_queue in total and max_per_user per user.
+    """
+
+    def __init__(self, command: str, size: int, max_queue: int, max_per_user: int):
+        self.command = command
+        self.size = size
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.engines = []
+        self._idle = deque()
+        self._available = asyncio.Condition()
+        self._games = 0
+        self._per_user = {}          # user_id -> games admitted and not yet finished
+        self._background = set()     # Keeps references to engine relaunch tasks until they finish
+        self.ready = False
+
+    def reserve(self, user_id: int, count: int):
+        """Admits count games for analysis, or raises QueueFullError like the review scheduler."""
+        if self._games + count > self.max_queue:
+            metrics.inc("queue_rejections", reason="engine_queue_full")
+            raise QueueFullError("⏳ The engine is busy right now, please try again in a few minutes.")
+        if self._per_user.get(user_id, 0) + count > self.max_per_user:
+            metrics.inc("queue_rejections", reason="engine_per_user_limit")
+            raise QueueFullError(f"⏳ You can have at most {self.max_per_user} games analyzed at once, please wait for the current ones.")
+        self._games += count
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + count
+
+    def release(self, user_id: int, count: int = 1):
+        self._games -= count
+        self._per_user[user_id] -= count
+        if not self._per_user[user_id]:
+            del self._per_user[user_id]
+
+    def limit(self):
+        return chess.engine.Limit(depth=ENGINE_DEPTH or None, time=ENGINE_MOVE_TIME or None)
+
+    async def _launch(self):
+        _, engine = await chess.engine.popen_uci(shlex.split(self.command))
+        options = {"Threads": ENGINE_THREADS, "Hash": ENGINE_HASH_MB}
+        await engine.configure({name: value for name, value in options.items() if name in engine.options})
+        return engine
+
+    async def start(self):
+        load_engine_stack()
+        self.engines = list(await asyncio.gather(*(self._launch() for _ in range(self.size))))
+        self._idle.extend(self.engines)
+        self.ready = True
+        name = self.engines[0].id.get("name", self.command)
+        logger.info(f"♟ Engine pool started: {self.size} x {name}.")
+
+    async def _replace(self, engine):
+        self.engines.remove(engine)
+        try:
+            await asyncio.wait_for(engine.quit(), 5)
+        except Exception:
+            pass
+        try:
+            replacement = await self._launch()
+        except Exception as e:
+            logger.error(f"❌ Could not restart a UCI engine, retrying in the background: {e}")
+            task = asyncio.create_task(self._relaunch())
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            async with self._available:
+                self._available.notify_all()  # Waiters fail instead of hanging if no engine is left
+            return None
+        self.engines.append(replacement)
+        return replacement
+
+    async def _relaunch(self):
+        """Brings a lost engine back, backing off up to a minute between attempts."""
+        delay = 1
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                engine = await self._launch()
+            except Exception as e:
+                delay = min(delay * 2, 60)
+                logger.warning(f"UCI engine restart failed, next attempt in {delay}s: {e}")
+                continue
+            self.engines.append(engine)
+            async with self._available:
+                self._idle.append(engine)
+                self._available.notify()
+            logger.info("♟ UCI engine restarted.")
+            return
+
+    @asynccontextmanager
+    async def lease(self):
+        async with self._available:
+            await self._available.wait_for(lambda: self._idle or not self.engines)
+            if not self._idle:
+                raise EngineUnavailableError("no UCI engine is running right now")
+            engine = self._idle.popleft()
+        try:
+            yield engine
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError):
+            metrics.inc("engine_restarts")
+            engine = await self._replace(engine)
+            raise
+        finally:
+            if engine is not None:
+                async with self._available:
+                    self._idle.append(engine)
+                    self._available.notify()
+
+    async def evaluate(self, board):
+        """Returns (score in centipawns from White's side, best move or None) for a position."""
+        if board.is_game_over():
+            outcome = board.outcome()
+            if outcome.winner is None:
+                return 0, None
+            return (MATE_SCORE if outcome.winner else -MATE_SCORE), None
+        async with self.lease() as engine:
+            info = await asyncio.wait_for(engine.analyse(board, self.limit()), ENGINE_MOVE_TIME * 10 + 30)
+        pv = info.get("pv") or [None]
+        return info["score"].white().score(mate_score=MATE_SCORE), pv[0]
+
+    async def shutdown(self):
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        for engine in self.engines:
+            try:
+                await asyncio.wait_for(engine.quit(), 5)
+            except Exception:
+                pass
+        self.ready = False
+
+
+engine_pool = EnginePool(ENGINE_PATH, ENGINE_POOL_SIZE, ENGINE_QUEUE_SIZE, ENGINE_MAX_PER_USER)
+
+
+class GameReport:
+    """Accuracy and flagged moves for one analysed game."""
+
+    def __init__(self, headers):
+        self.white = headers.get("White", "White")
+        self.black = headers.get("Black", "Black")
+        self.result = headers.get("Result", "*")
+        self.accuracy = {}                    # "White"/"Black" -> percent
+        self.counts = {"White": {}, "Black": {}}  # side -> label -> count
+        self.flagged = []                     # (move number text, san, symbol, best san) for mistakes and blunders
+
+    def text(self) -> str:
+        lines = [f"♟ {self.white} vs {self.black} ({self.result})"]
+        lines.append(" · ".join(f"{side} accuracy {value:.1f}%" for side, value in self.accuracy.items()))
+        for side, counts in self.counts.items():
+            summary = ", ".join(f"{counts.get(label, 0)} {label}" for _, label, _ in MOVE_LABELS)
+            lines.append(f"{side}: {summary}")
+        if self.flagged:
+            lines.append("\nKey moments:")
+            for number, san, symbol, best in self.flagged[:ENGINE_REPORT_MOVES]:
+                lines.append(f"{number} {san}{symbol}" + (f"  (best was {best})" if best else ""))
+        return "\n".join(lines)
+
+
+async def analyse_game(game) -> GameReport:
+    """Evaluates every position of the game in one batch and classifies each move."""
+    boards, moves = [], []
+    board = game.board()
+    for move in list(game.mainline_moves())[:ENGINE_MAX_PLIES]:
+        boards.append(board.copy(stack=False))
+        moves.append(move)
+        board.push(move)
+    boards.append(board.copy(stack=False))
+
+    with metrics.timed("engine_analysis", op="game"):
+        evaluations = await asyncio.gather(*(engine_pool.evaluate(b) for b in boards))
+
+    report = GameReport(game.headers)
+    accuracies = {"White": [], "Black": []}
+    for ply, move in enumerate(moves):
+        before, after = boards[ply], evaluations[ply + 1][0]
+        side = "White" if before.turn else "Black"
+        sign = 1 if before.turn else -1
+        loss = max(0.0, win_percent(sign * evaluations[ply][0]) - win_percent(sign * after))
+        accuracies[side].append(move_accuracy(loss))
+        for threshold, label, symbol in MOVE_LABELS:
+            if loss >= threshold:
+                report.counts[side][label] = report.counts[side].get(label, 0) + 1
+                if label != "inaccuracies":
+                    best_move = evaluations[ply][1]
+                    best = before.san(best_move) if best_move and best_move != move else None
+                    number = f"{before.fullmove_number}." if before.turn else f"{before.fullmove_number}..."
+                    report.flagged.append((number, before.san(move), symbol, best))
+                break
+    report.accuracy = {side: statistics.fmean(values) for side, values in accuracies.items() if values}
+    return report
+
+
+# --- Outbound Messages ---
+
+# Delivery order when sends compete for the rate limits; lower goes first.
+PRIORITY_RESULT = 0      # Review links, failures, anything that ends a request
+PRIORITY_STATUS = 1      # First replies and status messages
+PRIORITY_PROGRESS = 2    # Progress edits; superseded edits are dropped
+
+
+class TokenBucket:
+    """Allows `rate` sends per second with bursts up to `capacity`, plus a hard block for flood waits."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until one send is allowed (0 if it is allowed now)."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class OutboundMessage:
+    def __init__(self, chat_id: int, factory, priority: int, key, seq: int):
+        self.chat_id = chat_id
+        self.factory = factory        # Returns the Bot API coroutine; called once per attempt
+        self.priority = priority
+        self.key = key                # Sends with the same key replace each other while queued
+        self.seq = seq
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class Outbox:
+    """
+    Single dispatcher for chat messages, so the bot stays inside Telegram's flood
+    limits: a global token bucket, one per chat, priority for results over
+    progress edits, coalescing of queued edits to the same message, and RetryAfter
+    responses turned into a pause for the chat instead of a failed send.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}             # chat_id -> TokenBucket
+        self._queue = []             # Pending OutboundMessages; short, so scanned in priority order
+        self._by_key = {}
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._deliveries = set()
+        self._task = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._deliveries, return_exceptions=True)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                now = time.monotonic()
+                self._chats = {c: b for c, b in self._chats.items() if not b.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def send(self, chat_id: int, factory, priority=PRIORITY_RESULT, key=None):
+        """Queues a Bot API call and returns its result, or None if a later send with the same key replaced it."""
+        self._seq += 1
+        entry = OutboundMessage(chat_id, factory, priority, key, self._seq)
+        replaced = self._by_key.pop(key, None) if key is not None else None
+        if replaced is not None:
+            self._queue.remove(replaced)
+            entry.priority = min(entry.priority, replaced.priority)
+            replaced.future.set_result(None)
+            metrics.inc("outbox_coalesced")
+        self._enqueue(entry)
+        return await entry.future
+
+    def _enqueue(self, entry: OutboundMessage):
+        self._queue.append(entry)
+        if entry.key is not None:
+            self._by_key[entry.key] = entry
+        self._wakeup.set()
+
+    # Shorthands for the calls the handlers make.
+    def reply(self, message, text: str, priority=PRIORITY_RESULT, **kwargs):
+        return self.send(message.chat_id, lambda: message.reply_text(text, **kwargs), priority)
+
+    def reply_photo(self, message, photo: bytes, priority=PRIORITY_RESULT, **kwargs):
+        return self.send(message.chat_id, lambda: message.reply_photo(photo, **kwargs), priority)
+
+    def edit(self, message, text: str, priority=PRIORITY_PROGRESS, **kwargs):
+        return self.send(message.chat_id, lambda: message.edit_text(text, **kwargs), priority, (message.chat_id, message.message_id))
+
+    def delete(self, message, priority=PRIORITY_RESULT):
+        # Shares the edit key, so a pending progress edit to the message is dropped instead of sent.
+        return self.send(message.chat_id, message.delete, priority, (message.chat_id, message.message_id))
+
+    def _next(self, now: float):
+        """Returns (entry ready to send, None) or (None, seconds until one might be)."""
+        wait = self._global.delay(now)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for entry in sorted(self._queue, key=lambda e: (e.priority, e.seq)):
+            delay = self._bucket(entry.chat_id).delay(now)
+            if delay <= 0:
+                return entry, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            entry, wait = self._next(now)
+            if entry is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._queue.remove(entry)
+            if self._by_key.get(entry.key) is entry:
+                del self._by_key[entry.key]
+            self._global.take(now)
+            self._bucket(entry.chat_id).take(now)
+            metrics.observe("outbox_wait", now - entry.queued_at, priority=entry.priority)
+            task = asyncio.create_task(self._deliver(entry))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, entry: OutboundMessage):
+        entry.attempts += 1
+        try:
+            result = await entry.factory()
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+            metrics.inc("telegram_retry_after")
+            logger.warning(f"Flood limit hit for chat {entry.chat_id}; pausing it for {retry_after:.0f}s.")
+            self._bucket(entry.chat_id).blocked_until = time.monotonic() + retry_after
+            if entry.attempts <= self.max_retries and not entry.future.done():
+                if entry.key is not None and entry.key in self._by_key:
+                    entry.future.set_result(None)  # A newer send for this message is already queued
+                    return
+                self._enqueue(entry)
+                return
+            if not entry.future.done():
+                entry.future.set_exception(e)
+        except Exception as e:
+            if not entry.future.done():
+                entry.future.set_exception(e)
+        else:
+            if not entry.future.done():
+                entry.future.set_result(result)
+
+
+outbox = Outbox(OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_MAX_RETRIES)
+
+
 # --- Telegram Handler Functions ---
 
 async def set_config_command(update: Update, context: CallbackContext) -> None:
     """
-    Handles the /setconfig command to update Chess.com credentials.
-    This is an admin-only command and is protected by the selenium_lock.
+    Handles the /setconfig command to manage the Chess.com accounts.
+    This is an admin-only command. Changes pause the review scheduler so no browser
+    is mid-review while accounts and their profiles are swapped out.
+      /setconfig list                         - show accounts, load and cooldowns
+      /setconfig add <username> <password>    - add (or update) an account
+      /setconfig remove <username>            - remove an account and its profiles
+      /setconfig <username> <password>        - replace all accounts with this one
     """
     requesting_user_id = update.message.from_user.id
     if requesting_user_id != ADMIN_USER_ID:
         await update.message.reply_text("You are not authorized to use this command.")
         return
 
-    # --- NEW: Acquire the lock before modifying the profile ---
-    logger.info("Admin command /setconfig waiting for selenium lock...")
-    async with selenium_lock:
-        logger.info("Lock acquired for /setconfig.")
-        global CHESS_USERNAME, CHESS_PASSWORD
-        
-        args = context.args
-        if len(args) != 2:
-            await update.message.reply_text("Usage: /setconfig <username> <password>")
-            return # The 'with' block will automatically release the lock
-            
-        new_username, new_password = args[0], args[1]
-        
-        if save_credentials(new_username, new_password):
-            CHESS_USERNAME = new_username
-            CHESS_PASSWORD = new_password
-            
-            reply_message = "✅ Configuration updated successfully!"
-            
-            try:
-                if os.path.exists(LOCAL_PROFILE_PATH):
-                    shutil.rmtree(LOCAL_PROFILE_PATH)
-                    logger.info(f"Removed old chrome profile at: {LOCAL_PROFILE_PATH}")
-                    reply_message += "\n🧹 The old browser session has been cleared."
-                else:
-                    logger.info("No existing chrome profile to remove.")
-                    
-            except Exception as e:
-                logger.error(f"Failed to remove chrome profile: {e}")
-                reply_message += "\n⚠️ Could not remove the old browser session."
+    if BOT_ROLE == "frontend":
+        await update.message.reply_text("Accounts are configured on each worker node (its config.json or .env).")
+        return
 
-            await update.message.reply_text(reply_message)
-                
-        else:
-            await update.message.reply_text("❌ Failed to save new configuration. Please check the logs.")
-    # The lock is released here when the 'with' block finishes.
-    logger.info("Lock for /setconfig released.")
+    args = context.args
+    usage = ("Usage:\n/setconfig list\n/setconfig add <username> <password>\n"
+             "/setconfig remove <username>\n/setconfig <username> <password>")
+
+    if args == ["list"]:
+        if not account_pool.accounts:
+            await update.message.reply_text("No chess.com accounts configured.")
+            return
+        now = time.time()
+        lines = []
+        for account in account_pool.accounts:
+            slots = sum(1 for s in browser_pool.sessions if s.account is account)
+            status = "✅ active" if account.available() else f"⏸ cooling down {account.cooldown_until - now:.0f}s"
+            lines.append(f"{account.username}: {status}, {account.active_jobs} running, {slots} slot(s)")
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    if len(args) == 3 and args[0] == "add":
+        previous = list(account_pool.accounts)
+        account_pool.accounts = [a for a in previous if a.username != args[1]] + [ChessAccount(args[1], args[2])]
+        wipe, done = False, f"✅ Account {args[1]} added."
+    elif len(args) == 2 and args[0] == "remove":
+        if account_pool.get(args[1]) is None:
+            await update.message.reply_text(f"No account named {args[1]}.")
+            return
+        previous = list(account_pool.accounts)
+        account_pool.accounts = [a for a in previous if a.username != args[1]]
+        wipe, done = False, f"✅ Account {args[1]} removed."
+    elif len(args) == 2:
+        previous = list(account_pool.accounts)
+        account_pool.accounts = [ChessAccount(args[0], args[1])]
+        wipe, done = True, "✅ Configuration updated successfully!"
+    else:
+        await update.message.reply_text(usage)
+        return
+
+    if not account_pool.save():
+        account_pool.accounts = previous
+        await update.message.reply_text("❌ Failed to save new configuration. Please check the logs.")
+        return
+
+    # --- Pause dispatching before modifying the profiles; queued jobs keep their place ---
+    logger.info("Admin command /setconfig waiting for running reviews to finish...")
+    async with review_scheduler.paused():
+        logger.info("Scheduler paused for /setconfig.")
+        reply_message = done
+        try:
+            # Rebind the browser slots to the new account list; sessions of removed accounts lose their profiles.
+            await browser_pool.reset(wipe=wipe)
+            reply_message += "\n🧹 Browser sessions have been reassigned."
+        except Exception as e:
+            logger.error(f"Failed to reset browser pool: {e}")
+            reply_message += "\n⚠️ Could not reset the browser sessions."
+
+        await update.message.reply_text(reply_message)
+    # Dispatching resumes here when the 'with' block finishes.
+    logger.info("Scheduler resumed after /setconfig.")
 
 async def my_id_command(update: Update, context: CallbackContext) -> None:
     """Replies with the user's Telegram ID."""
     user_id = update.message.from_user.id
     await update.message.reply_text(f"Your Telegram User ID is: `{user_id}`", parse_mode='MarkdownV2')
 
+# This regex pattern finds the numerical game ID in various chess.com links.
+# It looks for patterns like /live/game/ID, /game/ID, or /analysis/game/live/ID.
+GAME_LINK_PATTERN = re.compile(r"chess\.com\/(?:live\/game|game|analysis\/game\/live)\/(\d+)")
+
+def extract_game_ids(message) -> list:
+    """Every distinct chess.com game ID linked in the message, in order, up to MAX_LINKS_PER_MESSAGE."""
+    game_ids = []
+    for url in message.parse_entities(types=[MessageEntity.URL]).values():
+        match = GAME_LINK_PATTERN.search(url)
+        if match and match.group(1) not in game_ids:
+            game_ids.append(match.group(1))
+    if len(game_ids) > MAX_LINKS_PER_MESSAGE:
+        logger.info(f"Message has {len(game_ids)} game links; only the first {MAX_LINKS_PER_MESSAGE} are reviewed.")
+    return game_ids[:MAX_LINKS_PER_MESSAGE]
+
+def analysis_url_for(game_id: str) -> str:
+    """Builds the final, standardized analysis URL."""
+    return f"{CHESS_BASE_URL}/analysis/game/live/{game_id}/review"
+
+def premium_text(reset_hint: str) -> str:
+    return (
+        "⚠️ *Daily Limit Reached* ⚠️\n\n"
+        "You've used all your free analyses for now\\.\n"
+        f"_Your credits will reset {reset_hint}\\._\n\n"
+        "\\-\\-\\-\n\n"
+        "🚀 **Want More\\? Go Premium\\!**\n"
+        "Enjoy unlimited analyses and faster, priority support\\.\n"
+        "`[Link to Your Premium Offer]`"
+    )
+
+def credits_info_text(credits_left: int, reset_hint: str) -> str:
+    return (
+        f"📊 *Credits Remaining:* **{credits_left}**\n"
+        f"_Credits reset {reset_hint}\\._\n\n"
+        f"🚀 **Go Premium\\!**\n"
+        f"Get unlimited reviews & priority support\\.\n"
+        f"Msg @HeyDmc for Premium\n\n"
+    )
+
+def is_pgn_document(document) -> bool:
+    return document is not None and (document.file_name or "").lower().endswith(".pgn")
+
+async def handle_pgn(message):
+    """
+    Analyses PGN games, pasted or uploaded as a .pgn file, with the local engine
+    pool instead of chess.com. Each game costs a credit and is journaled like a
+    browser review, so a failure or a crash refunds it, and each report is sent
+    as soon as its game is done.
+    """
+    user_id = message.from_user.id
+    if message.document:
+        if (message.document.file_size or 0) > PGN_MAX_BYTES:
+            await outbox.reply(message, f"That PGN file is too large (limit {PGN_MAX_BYTES // 1024} KB).")
+            return
+        pgn_file = await message.document.get_file()
+        text = bytes(await pgn_file.download_as_bytearray()).decode("utf-8", errors="replace")
+    else:
+        text = message.text
+
+    games = parse_pgn_games(text, MAX_LINKS_PER_MESSAGE)
+    if not games:
+        await outbox.reply(message, "I couldn't read a game from that PGN.")
+        return
+
+    credits, window = credit_store.refresh(user_id)
+    reset_hint = escape_markdown(credit_policy.reset_hint(window), version=2)
+    if credits <= 0:
+        logger.info(f"User {user_id} has no credits left.")
+        await outbox.reply(message, premium_text(reset_hint), parse_mode='MarkdownV2')
+        return
+    try:
+        engine_pool.reserve(user_id, len(games))
+    except QueueFullError as e:
+        logger.info(f"Rejected PGN from user {user_id}: {e}")
+        await outbox.reply(message, f"{e} Your credits were not used.")
+        return
+    # Journal entries are keyed by the PGN's hash, so resending it while it runs is refused.
+    digest = hashlib.sha1(text.encode()).hexdigest()[:16]
+    job_ids = [f"pgn:{digest}:{number}" for number in range(1, len(games) + 1)]
+    try:
+        credits_left = credit_store.start_jobs(user_id, job_ids, message.chat_id)
+    except DuplicateJobError as e:
+        engine_pool.release(user_id, len(games))
+        await outbox.reply(message, str(e))
+        return
+    if credits_left is None:
+        engine_pool.release(user_id, len(games))
+        await outbox.reply(message, f"This PGN has {len(games)} games but you have {credits} credits left. Please send fewer games at once.")
+        return
+    logger.info(f"User {user_id} used {len(games)} credit(s) for engine analysis. {credits_left} remaining.")
+
+    async def analyse_journaled(job_id, game):
+        # Settles the journal entry itself, so sending the reports can't leave it open.
+        credit_store.mark_job_running(user_id, job_id)
+        try:
+            report = await analyse_game(game)
+        except Exception as e:
+            credit_store.finish_job(user_id, job_id, ok=False, error=str(e) or type(e).__name__)
+            raise
+        finally:
+            engine_pool.release(user_id)
+        credit_store.finish_job(user_id, job_id, ok=True)
+        return report
+
+    analyses = [asyncio.create_task(analyse_journaled(job_id, game)) for job_id, game in zip(job_ids, games)]
+    status_message = await outbox.reply(message, f"♟ Analyzing {len(games)} game(s) with the engine...", PRIORITY_STATUS)
+    refunds = 0
+    for finished in asyncio.as_completed(analyses):
+        try:
+            report = await finished
+        except Exception as e:
+            logger.error(f"Engine analysis failed: {e}")
+            refunds += 1
+            await outbox.reply(message, "Sorry, the engine could not analyze one of the games. Your credit was refunded.")
+            continue
+        await outbox.reply(message, report.text())
+    await outbox.delete(status_message)
+
+    if refunds:
+        # The failed analyses were refunded when their journal entries were closed.
+        credits_left += refunds
+    await outbox.reply(message, credits_info_text(credits_left, reset_hint), parse_mode='MarkdownV2', disable_web_page_preview=True)
+
 async def handle_game_link(update: Update, context: CallbackContext) -> None:
     """
-    Parses multiple chess.com URL formats to extract a game ID,
+    Parses multiple chess.com URL formats to extract the game IDs,
     checks user credits, and triggers the login flow if credits are available.
+    Messages with several links are handed to handle_game_batch, and PGNs to
+    handle_pgn when an engine is configured.
     """
     message = update.message
-    if not message or not message.text:
+    if not message:
+        return
+    # PGNs, pasted or uploaded, go to the local engine instead of chess.com.
+    if engine_pool.ready and (is_pgn_document(message.document) or looks_like_pgn(message.text)):
+        await handle_pgn(message)
+        return
+    if not message.text:
         return
 
     urls = message.parse_entities(types=[MessageEntity.URL])
     if not urls:
         return
 
-    first_url = list(urls.values())[0]
+    game_ids = extract_game_ids(message)
+    if not game_ids:
+        # If no URL matches a known game link format, inform the user.
+        await outbox.reply(message, "Please send a valid chess.com game link.")
+        return
+    if len(game_ids) > 1:
+        await handle_game_batch(message, game_ids)
+        return
 
-    # --- NEW: VERSATILE URL PARSING ---
-    # This regex pattern finds the numerical game ID in various chess.com links.
-    # It looks for patterns like /live/game/ID, /game/ID, or /analysis/game/live/ID.
-    pattern = r"chess\.com\/(?:live\/game|game|analysis\/game\/live)\/(\d+)"
-    match = re.search(pattern, first_url)
+    game_id = game_ids[0]
+    logger.info(f"Extracted game ID: {game_id} from message {message.message_id}")
 
-    if not match:
-        # If the URL doesn't match a known game link format, inform the user.
-        await message.reply_text("Please send a valid chess.com game link.")
+    # --- CACHE / SINGLE-FLIGHT: repeat links never touch the browser or credits ---
+    cached_url = review_cache.get(game_id)
+    if cached_url:
+        logger.info(f"Cache hit for game {game_id}.")
+        await outbox.reply(message, f"Here is your Game review:\n{cached_url}", disable_web_page_preview=False)
         return
 
-    # The game ID is the first captured group from our regex.
-    game_id = match.group(1)
-    logger.info(f"Extracted game ID: {game_id} from URL: {first_url}")
+    if game_id in inflight_reviews:
+        logger.info(f"Game {game_id} is already being analyzed; waiting for that run.")
+        status_message = await outbox.reply(message, "⏳ This game is already being analyzed, hang on...", PRIORITY_STATUS)
+        flight = inflight_reviews[game_id]
+        await asyncio.wait([flight])
+        if flight.cancelled() or flight.exception() is not None:
+            await outbox.edit(status_message, "Sorry, something went wrong while analyzing the game. Please try again later.", PRIORITY_RESULT)
+            return
+        await outbox.delete(status_message)
+        await outbox.reply(message, f"Here is your Game review:\n{analysis_url_for(game_id)}", disable_web_page_preview=False)
+        return
 
-    # --- CREDIT SYSTEM LOGIC (No changes here) ---
+    # --- CREDIT SYSTEM LOGIC: top up a new window lazily, then check the balance ---
     user_id = message.from_user.id
-    user_id_str = str(user_id) # JSON keys must be strings
-    today = date.today().isoformat()
-
-    user_data = load_user_data()
+    credits, window = credit_store.refresh(user_id)
+    reset_hint = escape_markdown(credit_policy.reset_hint(window), version=2)
 
-    if user_id_str not in user_data or user_data[user_id_str].get('last_seen') != today:
-        user_data[user_id_str] = {'credits': 3, 'last_seen': today}
-        save_user_data(user_data)
-        logger.info(f"Initialized/Refreshed credits for user {user_id}")
-
-    if user_data[user_id_str]['credits'] <= 0:
+    if credits <= 0:
         logger.info(f"User {user_id} has no credits left.")
-        
-        # This is the new, formatted message string
-        premium_message = (
-            "⚠️ *Daily Limit Reached* ⚠️\n\n"
-            "You've used all your free analyses for today\\.\n"
-            "_Your credits will reset at midnight\\._\n\n"
-            "\\-\\-\\-\n\n"
-            "🚀 **Want More\\? Go Premium\\!**\n"
-            "Enjoy unlimited analyses and faster, priority support\\.\n"
-            "`[Link to Your Premium Offer]`"
-        )
-        
-        # Make sure to send it with the correct parse mode
-        await message.reply_text(premium_message, parse_mode='MarkdownV2')
+        await outbox.reply(message, premium_text(reset_hint), parse_mode='MarkdownV2')
         return # Stop processing the request
 
     # --- MAIN PROCESSING LOGIC ---
-    if not CHESS_USERNAME or not CHESS_PASSWORD:
-        await message.reply_text("Chess.com credentials are not set by the admin.")
+    if not reviews_configured():
+        await outbox.reply(message, "Chess.com credentials are not set by the admin.")
         return
 
-    user_data[user_id_str]['credits'] -= 1
-    save_user_data(user_data)
-    logger.info(f"User {user_id} used a credit. {user_data[user_id_str]['credits']} remaining.")
+    try:
+        # Charges the credit and journals the job together, so a crash can't lose either.
+        credits_left = credit_store.start_jobs(user_id, [game_id], message.chat_id)
+    except DuplicateJobError as e:
+        await outbox.reply(message, str(e))
+        return
+    if credits_left is None:
+        # Another message from this user spent the last credit in the meantime.
+        await outbox.reply(message, "You have no credits left right now.")
+        return
+    logger.info(f"User {user_id} used a credit. {credits_left} remaining.")
 
-# Build the final, standardized analysis URL
-    analysis_url = f"https://www.chess.com/analysis/game/live/{game_id}/review"
-    
-    async with selenium_lock:
-        # Send the initial status message
-        status_message = await message.reply_text("*Preparing analysis...*", parse_mode='Markdown')
+    analysis_url = analysis_url_for(game_id)
+    flight = start_flight(game_id, analysis_url)
 
-        # 1. Start the actual analysis in a background task
-        logger.info("Starting Selenium task in the background.")
-        analysis_task = asyncio.create_task(
-            asyncio.to_thread(run_chess_login_flow, game_url=analysis_url)
-        )
+    # 1. Queue the analysis; a free browser worker picks it up in fair order.
+    # Until the flight is chained to the job, any failure must settle it, or
+    # later requests for this game would wait on it forever.
+    try:
+        # Screenshots are opt-in: adding #screenshot to the message asks for one.
+        want_screenshot = "#screenshot" in message.text.lower()
+        job = await review_scheduler.submit(user_id, game_id, want_screenshot)
+    except QueueFullError as e:
+        logger.info(f"Rejected job for user {user_id}: {e}")
+        flight.cancel()
+        credit_store.finish_job(user_id, game_id, ok=False, error="queue_full")
+        await outbox.reply(message, f"{e} Your credit was not used.", PRIORITY_RESULT)
+        return
+    except BaseException as e:
+        flight.cancel()
+        credit_store.finish_job(user_id, game_id, ok=False, error=str(e) or type(e).__name__)
+        raise
 
-        # 2. While the task runs, simulate a progress bar for the user
-        total_duration = 15  # Total estimated time for the analysis in seconds
-        steps = 10          # We will update the bar 100 times
-        for i in range(steps + 1):
-            percentage = i * 10
-            progress_bar = "█" * i + "░" * (steps - i) # Creates a visual bar
+    chain_flight(flight, job.future)
 
-            # We use MarkdownV2 for the code block `` which makes the bar look clean
-            text = f"*Analyzing your game\\.\\.\\.*\n\n`{progress_bar} {percentage}%`"
-            
-            try:
-                await status_message.edit_text(text, parse_mode='MarkdownV2')
-            except Exception: # Ignore potential "message is not modified" error
-                pass
-            
-            # Don't sleep on the final 100% step
-            if i < steps:
-                await asyncio.sleep(total_duration / steps)
-
-        # 3. Wait for the background task to actually finish
-        logger.info("Progress simulation finished. Awaiting Selenium task completion...")
-        try:
-            await analysis_task
-            logger.info("Selenium task completed successfully.")
-
-            # Delete the status message before sending the final result
-            await status_message.delete()
-
-            # --- MESSAGE 1: The Game Link ---
-            link_message = f"Here is your Game review:\n{analysis_url}"
-            await message.reply_text(link_message, disable_web_page_preview=False)
-
-            await asyncio.sleep(1)
-
-            # --- MESSAGE 2: Credits and Info ---
-            credits_left = user_data[user_id_str]['credits']
-            info_message = (
-                f"📊 *Credits Remaining:* **{credits_left}**\n"
-                f"_Credits reset daily at midnight\\._\n\n"
-                f"🚀 **Go Premium\\!**\n"
-                f"Get unlimited reviews & priority support\\.\n"
-                f"Msg @HeyDmc for Premium\n\n"
+    # Send the initial status message; the job runs (and settles the flight) even if this fails.
+    status_message = await outbox.reply(message, "*Preparing analysis...*", PRIORITY_STATUS, parse_mode='Markdown')
+
+    # 2. Show real progress until the job finishes, then reply straight away
+    await follow_progress(job, status_message)
+
+    # 3. Collect the outcome of the background task
+    try:
+        screenshot = await job.future
+    except Exception as e:
+        # The scheduler has already marked the job failed in the journal and refunded the credit.
+        logger.error(f"The chess flow failed: {e}")
+        try:
+            await outbox.edit(status_message, "Sorry, something went wrong while analyzing the game. Your credit was refunded, please try again later.", PRIORITY_RESULT)
+        except Exception as send_error:
+            logger.warning(f"Could not tell user {user_id} that game {game_id} failed: {send_error}")
+        return
+    logger.info("Selenium task completed successfully.")
+
+    # The review succeeded and the credit is spent; a failed send below must not claim a refund.
+    try:
+        # Delete the status message before sending the final result
+        await outbox.delete(status_message)
+
+        # --- One message: the game link (which gets the preview) followed by credits and info ---
+        link_message = f"Here is your Game review:\n{escape_markdown(analysis_url, version=2)}\n\n"
+        await outbox.reply(message, link_message + credits_info_text(credits_left, reset_hint), parse_mode='MarkdownV2', disable_web_page_preview=False)
+
+        if screenshot:
+            await outbox.reply_photo(message, screenshot, caption="Review page screenshot")
+    except Exception as e:
+        logger.warning(f"Could not deliver the review of game {game_id} to user {user_id}: {e}")
+
+def batch_text(game_ids: list, outcomes: dict) -> str:
+    """Plain-text combined status for a batch: one line per game, filled in as results arrive."""
+    lines = [f"Reviewing {len(game_ids)} games:"]
+    for number, game_id in enumerate(game_ids, 1):
+        outcome = outcomes.get(game_id)
+        if outcome is None:
+            lines.append(f"{number}. ⏳ Game {game_id}: analyzing...")
+        elif outcome == "ok":
+            lines.append(f"{number}. ✅ {analysis_url_for(game_id)}")
+        else:
+            lines.append(f"{number}. ❌ Game {game_id}: {outcome}")
+    return "\n".join(lines)
+
+async def handle_game_batch(message, game_ids: list):
+    """
+    Reviews several games from one message. Credits for the games that need a
+    browser are spent and journaled all at once (or not at all), the jobs are queued together so
+    they run in parallel across the pool, and a single reply is edited as each
+    result completes. Credits for games that fail are refunded.
+    """
+    user_id = message.from_user.id
+    logger.info(f"User {user_id} sent {len(game_ids)} game links: {', '.join(game_ids)}")
+
+    # --- CACHE / SINGLE-FLIGHT: repeat links are free and never reach the scheduler ---
+    outcomes = {}      # game_id -> "ok" or a short failure reason
+    followed = {}      # game_id -> flight owned by another request
+    new_ids = []
+    for game_id in game_ids:
+        if review_cache.get(game_id):
+            outcomes[game_id] = "ok"
+        elif game_id in inflight_reviews:
+            followed[game_id] = inflight_reviews[game_id]
+        else:
+            new_ids.append(game_id)
+
+    credits_left = reset_hint = None
+    jobs = {}          # game_id -> ReviewJob for the games this message pays for
+    if new_ids:
+        if not reviews_configured():
+            await outbox.reply(message, "Chess.com credentials are not set by the admin.")
+            return
+        credits, window = credit_store.refresh(user_id)
+        reset_hint = escape_markdown(credit_policy.reset_hint(window), version=2)
+        if credits <= 0:
+            logger.info(f"User {user_id} has no credits left.")
+            await outbox.reply(message, premium_text(reset_hint), parse_mode='MarkdownV2')
+            return
+        try:
+            credits_left = credit_store.start_jobs(user_id, new_ids, message.chat_id)
+        except DuplicateJobError as e:
+            await outbox.reply(message, str(e))
+            return
+        if credits_left is None:
+            await outbox.reply(
+                message,
+                f"These links need {len(new_ids)} credits but you have {credits} left. "
+                f"Please send fewer links at once."
             )
-            await message.reply_text(info_message, parse_mode='MarkdownV2', disable_web_page_preview=True)
+            return
+        logger.info(f"User {user_id} used {len(new_ids)} credits. {credits_left} remaining.")
 
-        except Exception as e:
-            logger.error(f"The chess flow failed: {e}")
-            await status_message.edit_text("Sorry, something went wrong while analyzing the game. Please try again later.")
+        # Flights are registered before the first await so concurrent requests follow them.
+        flights = {game_id: start_flight(game_id, analysis_url_for(game_id)) for game_id in new_ids}
+        try:
+            want_screenshot = "#screenshot" in message.text.lower()
+            queued = await review_scheduler.submit_batch(user_id, new_ids, want_screenshot)
+        except QueueFullError as e:
+            logger.info(f"Rejected batch for user {user_id}: {e}")
+            for game_id, flight in flights.items():
+                flight.cancel()
+                credit_store.finish_job(user_id, game_id, ok=False, error="queue_full")
+            await outbox.reply(message, f"{e} Your credits were not used.")
+            return
+        for game_id, job in zip(new_ids, queued):
+            chain_flight(flights[game_id], job.future)
+            jobs[game_id] = job
+
+    status_message = await outbox.reply(message, batch_text(game_ids, outcomes), PRIORITY_STATUS, disable_web_page_preview=True)
+
+    # --- Fan in: update the combined reply as each game finishes ---
+    waiting = {job.future: game_id for game_id, job in jobs.items()}
+    waiting.update({flight: game_id for game_id, flight in followed.items()})
+    refunds = 0
+    loop = asyncio.get_running_loop()
+    last_edit = loop.time()
+    while waiting:
+        done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+        delay = last_edit + PROGRESS_EDIT_INTERVAL - loop.time()
+        if delay > 0:
+            # Keep edits as far apart as single-game progress updates; results landing meanwhile share one edit.
+            more, _ = await asyncio.wait(waiting, timeout=delay)
+            done |= more
+        for future in done:
+            game_id = waiting.pop(future)
+            if not future.cancelled() and future.exception() is None:
+                outcomes[game_id] = "ok"
+                if game_id in jobs and future.result():
+                    await outbox.reply_photo(message, future.result(), caption=f"Review page screenshot for game {game_id}")
+                continue
+            logger.error(f"Batch review of game {game_id} failed: {'cancelled' if future.cancelled() else future.exception()}")
+            if game_id in jobs:
+                refunds += 1
+                outcomes[game_id] = "failed, credit refunded"
+            else:
+                outcomes[game_id] = "failed, please try again later"
+        try:
+            # The last edit carries the final results, so it is not queued behind other chats' progress.
+            await outbox.edit(status_message, batch_text(game_ids, outcomes), PRIORITY_PROGRESS if waiting else PRIORITY_RESULT, disable_web_page_preview=True)
+        except Exception: # Ignore potential "message is not modified" error
+            pass
+        last_edit = loop.time()
+
+    if refunds:
+        # The scheduler refunded these when it marked the jobs failed in the journal.
+        credits_left += refunds
+        logger.info(f"Refunded {refunds} credit(s) to user {user_id} for failed reviews.")
+    if credits_left is not None:
+        await outbox.reply(message, credits_info_text(credits_left, reset_hint), parse_mode='MarkdownV2', disable_web_page_preview=True)
+
+
+# --- Admission Control ---
+
+class AdmissionRejected(Exception):
+    """A message was turned away before any work; notify is False for repeats the user was already told about."""
+
+    def __init__(self, message: str, reason: str, notify: bool):
+        super().__init__(message)
+        self.reason = reason
+        self.notify = notify
+
+
+class AdmissionControl:
+    """
+    First, in-memory gate for review requests: a token bucket per user and one for
+    the whole bot, and a check that the user is not already waiting on the same
+    game. Rejections cost no storage or queue work, and each user is told to back
+    off at most once per wait, so a flood of messages gets a single reply.
+    """
 
+    def __init__(self, user_rate: float, user_burst: float, global_rate: float, global_burst: float):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self._global = TokenBucket(global_rate, global_burst)
+        self._users = {}         # user_id -> TokenBucket
+        self._inflight = {}      # user_id -> set of request keys being handled
+        self._quiet_until = {}   # user_id -> monotonic time before which rejections are silent
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            if len(self._users) >= 10000:
+                now = time.monotonic()
+                self._users = {u: b for u, b in self._users.items() if not b.idle(now) or u in self._inflight}
+                self._quiet_until = {u: t for u, t in self._quiet_until.items() if t > now}
+            bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def _reject(self, user_id: int, message: str, reason: str, wait: float):
+        now = time.monotonic()
+        metrics.inc("admission_rejections", reason=reason)
+        notify = self._quiet_until.get(user_id, 0) <= now
+        if notify:
+            self._quiet_until[user_id] = now + max(wait, 1.0)
+        raise AdmissionRejected(message, reason, notify)
+
+    @contextmanager
+    def admitted(self, user_id: int, keys):
+        """Holds the user's keys as in flight for the block; raises AdmissionRejected instead of entering it."""
+        keys = set(keys)
+        if keys & self._inflight.get(user_id, set()):
+            self._reject(user_id, "⏳ You already sent this game, it is still being reviewed.", "duplicate", 0)
+        now = time.monotonic()
+        bucket = self._bucket(user_id)
+        wait = bucket.delay(now)
+        if wait > 0:
+            self._reject(user_id, f"⏳ Slow down, please try again in {math.ceil(wait)}s.", "user_rate", wait)
+        wait = self._global.delay(now)
+        if wait > 0:
+            self._reject(user_id, f"⏳ The bot is busy right now, please try again in {math.ceil(wait)}s.", "global_rate", wait)
+        bucket.take(now)
+        self._global.take(now)
+
+        self._inflight.setdefault(user_id, set()).update(keys)
+        try:
+            yield
         finally:
-             # This block runs after the 'try' or 'except'
-             logger.info("Replying to user complete. Starting background profile cleanup.")
-             await asyncio.to_thread(clean_chrome_profile)
+            remaining = self._inflight[user_id] - keys
+            if remaining:
+                self._inflight[user_id] = remaining
+            else:
+                del self._inflight[user_id]
+
+
+admission = AdmissionControl(ADMISSION_USER_RATE, ADMISSION_USER_BURST, ADMISSION_GLOBAL_RATE, ADMISSION_GLOBAL_BURST)
+
+def request_keys(message, is_pgn: bool) -> list:
+    """What a message asks for, for the duplicate check: its game IDs, or the PGN it carries."""
+    if is_pgn:
+        source = message.document.file_unique_id if message.document else message.text
+        return [f"pgn:{hashlib.sha1(source.encode()).hexdigest()}"]
+    return [f"game:{game_id}" for game_id in extract_game_ids(message)] if message.text else []
+
+async def admit_game_request(update: Update, context: CallbackContext) -> None:
+    """Runs handle_game_link only for messages that pass admission control."""
+    message = update.message
+    if not message or not message.from_user:
+        return
+    is_pgn = engine_pool.ready and (is_pgn_document(message.document) or looks_like_pgn(message.text))
+    try:
+        with admission.admitted(message.from_user.id, request_keys(message, is_pgn)):
+            await handle_game_link(update, context)
+    except AdmissionRejected as e:
+        logger.info(f"Turned away a message from user {message.from_user.id}: {e.reason}.")
+        if e.notify:
+            await outbox.reply(message, str(e), PRIORITY_STATUS)
+
 
 # REPLACE this entire function
 
 async def start_command(update: Update, context: CallbackContext) -> None:
     """Sends a welcome message and instructions when the /start command is issued."""
     # We've added '\' before each special character '!' and '.'
+    period = "every day" if credit_policy.mode == "daily" else "every 24 hours"
     welcome_message = (
         "👋 **Welcome to the Chess Game Review Bot\\!**\n\n"
         "I can provide a free analysis of your games from Chess\\.com\\.\n\n"
@@ -526,46 +3432,427 @@ async def start_command(update: Update, context: CallbackContext) -> None:
         "Simply  Share me the game, and I'll get to work\\.\n\n"
         " It only work for Mobile Users 📲\\.\n\n"
         " For PC Users 💻 please msg @HeyDmc\\.\n\n"
-        "You get **3 free reviews** every day\\. Enjoy\\!"
+        f"You get **{credit_policy.quota('free')} free reviews** {period}\\. Enjoy\\!"
     )
     await update.message.reply_text(welcome_message, parse_mode='MarkdownV2')
 
+# --- Job Recovery ---
+
+# Keeps references to result deliveries for resumed jobs until they finish.
+recovery_tasks = set()
+
+async def deliver_recovered(bot, user_id: int, chat_id: int, game_id: str, future, journaled: bool):
+    """Waits for a resumed review and sends its outcome to the chat it was requested from."""
+    await asyncio.wait([future])
+    ok = not future.cancelled() and future.exception() is None
+    if not journaled:
+        # Followed another user's run instead of running its own job; close its journal entry here.
+        credit_store.finish_job(user_id, game_id, ok, None if ok else "failed after restart")
+    if ok:
+        text = f"Here is your Game review:\n{analysis_url_for(game_id)}"
+    else:
+        text = f"Sorry, the review of game {game_id} could not be finished after a restart. Your credit was refunded."
+    try:
+        await outbox.send(chat_id, lambda: bot.send_message(chat_id, text), PRIORITY_RESULT)
+    except Exception as e:
+        logger.warning(f"Could not deliver recovered review of game {game_id} to chat {chat_id}: {e}")
+
+async def recover_jobs(bot):
+    """
+    Picks up reviews the journal still has as queued or running from before a
+    restart. Ones younger than JOB_RESUME_MAX_AGE are queued again and their result
+    is sent to the chat; older ones, or ones that no longer fit in the queue, are
+    refunded and the user is told.
+    """
+    unfinished = credit_store.unfinished_jobs()
+    if not unfinished:
+        return
+    logger.info(f"Recovering {len(unfinished)} unfinished review(s) from the journal...")
+    resumed = 0
+    for user_id, game_id, chat_id, created_at in unfinished:
+        future, journaled = None, True
+        # Engine analyses keep no copy of their PGN, so they can only be refunded.
+        if time.time() - created_at <= JOB_RESUME_MAX_AGE and not game_id.startswith("pgn:"):
+            if game_id in inflight_reviews:
+                future, journaled = inflight_reviews[game_id], False
+            else:
+                flight = start_flight(game_id, analysis_url_for(game_id))
+                try:
+                    job = await review_scheduler.submit(user_id, game_id)
+                except QueueFullError:
+                    flight.cancel()
+                else:
+                    chain_flight(flight, job.future)
+                    future = job.future
+
+        if future is None:
+            credit_store.finish_job(user_id, game_id, ok=False, error="not resumed after restart")
+            if game_id.startswith("pgn:"):
+                text = "Sorry, the bot restarted before your PGN analysis finished. Your credit was refunded, please send the PGN again."
+            else:
+                text = f"Sorry, the bot restarted before your review of game {game_id} finished. Your credit was refunded."
+            task = asyncio.create_task(outbox.send(chat_id, lambda chat_id=chat_id, text=text: bot.send_message(chat_id, text), PRIORITY_RESULT))
+        else:
+            resumed += 1
+            task = asyncio.create_task(deliver_recovered(bot, user_id, chat_id, game_id, future, journaled))
+        recovery_tasks.add(task)
+        task.add_done_callback(recovery_tasks.discard)
+    logger.info(f"Resumed {resumed} review(s), refunded {len(unfinished) - resumed}.")
+
+# --- Job Broker ---
+
+async def broker_request(path: str, body: dict):
+    """Dispatches one broker call from a worker node; returns (status, JSON payload or None)."""
+    if path == "/lease":
+        leased = await review_scheduler.lease(str(body.get("node", "?")), min(float(body.get("wait", 0)), BROKER_POLL_SECONDS))
+        if leased is None:
+            return 204, None
+        token, job = leased
+        return 200, {
+            "token": token,
+            "game_url": job.game_url,
+            "want_screenshot": job.want_screenshot,
+            "lease_seconds": BROKER_LEASE_SECONDS,
+        }
+    if path == "/heartbeat":
+        if review_scheduler.heartbeat(body.get("token"), body.get("stage")):
+            return 200, {}
+        return 404, {"error": "lease lost"}
+    if path == "/result":
+        screenshot = base64.b64decode(body["screenshot"]) if body.get("screenshot") else None
+        if await review_scheduler.complete(body.get("token"), bool(body.get("ok")), screenshot, body.get("error")):
+            return 200, {}
+        return 404, {"error": "lease lost"}
+    return 404, {"error": "unknown endpoint"}
+
+async def serve_broker(reader, writer):
+    """
+    Minimal JSON-over-HTTP responder worker nodes lease jobs from. Every request
+    must carry BROKER_TOKEN as a bearer token.
+    """
+    leased_token = None
+    try:
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        request_line, *header_lines = head.split("\r\n")
+        method, path, _ = request_line.split(" ", 2)
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+
+        # Nothing past the headers is read until the caller is known and the body is of sane size.
+        if not secrets.compare_digest(headers.get("authorization", ""), f"Bearer {BROKER_TOKEN}"):
+            status, payload = 401, {"error": "unauthorized"}
+        elif method != "POST":
+            status, payload = 405, {"error": "use POST"}
+        elif not 0 <= length <= BROKER_MAX_BODY_BYTES:
+            status, payload = 413, {"error": f"body over {BROKER_MAX_BODY_BYTES} bytes"}
+        else:
+            body = await reader.readexactly(length)
+            # Nodes send nothing more, so this read only completes if the node hangs up,
+            # e.g. restarts in the middle of a long-poll.
+            hangup = asyncio.create_task(reader.read(1))
+            try:
+                status, payload = await broker_request(path, json.loads(body or b"{}"))
+            finally:
+                hung_up = hangup.done()
+                hangup.cancel()
+            if path == "/lease" and status == 200:
+                leased_token = payload["token"]
+            if hung_up:
+                return
+
+        data = json.dumps(payload).encode() if payload is not None else b""
+        writer.write(
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n".encode()
+            + f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode()
+            + data
+        )
+        await writer.drain()
+        leased_token = None  # Delivered
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+        if leased_token:
+            # The job never reached a node; put it back instead of waiting for the lease to expire.
+            await review_scheduler.release(leased_token)
+
+
+# --- Worker Node ---
+
+class BrokerClient:
+    """A worker node's connection to the front-end's job broker."""
+
+    def __init__(self, base_url: str, token: str, node: str):
+        self.node = node
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=BROKER_POLL_SECONDS + 10,  # A lease request may be held open for BROKER_POLL_SECONDS
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def lease(self):
+        """Returns the next job as a dict, or None if none arrived within BROKER_POLL_SECONDS."""
+        response = await self.client.post("/lease", json={"node": self.node, "wait": BROKER_POLL_SECONDS})
+        if response.status_code == 204:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    async def heartbeat(self, token: str, stage: str) -> bool:
+        """Extends the lease; False once the front-end has given the job to another node."""
+        response = await self.client.post("/heartbeat", json={"token": token, "stage": stage})
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    async def post_result(self, token: str, ok: bool, screenshot=None, error: str = None) -> bool:
+        payload = {
+            "token": token,
+            "ok": ok,
+            "error": error,
+            "screenshot": base64.b64encode(screenshot).decode() if screenshot else None,
+        }
+        response = await self.client.post("/result", json=payload)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+
+class LeaseKeeper:
+    """
+    Heartbeats one leased job while this node works on it: right away on each stage
+    change, so the user's progress message keeps moving, and otherwise every
+    BROKER_HEARTBEAT_SECONDS.
+    """
+
+    def __init__(self, broker: BrokerClient, token: str):
+        self.broker = broker
+        self.token = token
+        self.stage = "leased"
+        self.changed = asyncio.Event()
+        self._task = None
+
+    def report_stage(self, stage: str):
+        self.stage = stage
+        self.changed.set()
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), BROKER_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+            try:
+                if not await self.broker.heartbeat(self.token, self.stage):
+                    logger.warning("Lease was taken back by the front-end; the result will be discarded.")
+                    return
+            except httpx.HTTPError as e:
+                logger.warning(f"Heartbeat failed, retrying: {e}")
+
+async def node_worker(broker: BrokerClient, worker_id: int):
+    """One review loop of a worker node: lease a job, run it in the local pool, post the result."""
+    while True:
+        try:
+            lease = await broker.lease()
+        except httpx.HTTPError as e:
+            logger.warning(f"Broker at {BROKER_URL} unreachable from worker {worker_id}: {e}")
+            await asyncio.sleep(BROKER_HEARTBEAT_SECONDS)
+            continue
+        if lease is None:
+            continue
+
+        logger.info(f"Worker {worker_id} leased {lease['game_url']}.")
+        async with LeaseKeeper(broker, lease["token"]) as keeper:
+            try:
+                with metrics.timed("review_total"):
+                    screenshot = await run_review(lease["game_url"], keeper.report_stage, lease["want_screenshot"])
+                outcome = {"ok": True, "screenshot": screenshot}
+            except Exception as e:
+                outcome = {"ok": False, "error": str(e) or type(e).__name__}
+
+        # Keep trying while the lease is still valid; after that the front-end requeues the job anyway.
+        for attempt in range(5):
+            try:
+                if not await broker.post_result(lease["token"], **outcome):
+                    logger.warning(f"Lease for {lease['game_url']} expired before its result was posted.")
+                break
+            except httpx.HTTPError as e:
+                logger.warning(f"Posting result for {lease['game_url']} failed (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+
+async def run_worker_node() -> None:
+    """
+    Worker role: no Telegram and no credits. Leases reviews from the front-end's job
+    broker and runs them on this node's own browser pool and chess.com accounts.
+    Add capacity by starting more nodes against the same BROKER_URL.
+    """
+    account_pool.load()
+    if not account_pool.accounts:
+        logger.error("No chess.com accounts configured for this worker node. Please check config.json or your .env file.")
+        return
+    if not BROKER_TOKEN:
+        logger.error("BOT_ROLE=worker needs BROKER_TOKEN. Please check your .env file.")
+        return
+
+    logger.info(f"Worker node {NODE_NAME} starting against {BROKER_URL}...")
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = await asyncio.start_server(serve_metrics, METRICS_LISTEN, METRICS_PORT)
+        logger.info(f"Prometheus metrics on http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+    session_manager.start()
+    profile_maintainer.start()
+    broker = BrokerClient(BROKER_URL, BROKER_TOKEN, NODE_NAME)
+    loops = []
+    try:
+        try:
+            await prepare_browser_tier()
+        except RuntimeError as e:
+            logger.critical(f"❌ Browser stack could not be prepared: {e}")
+            return
+
+        # One loop per pool slot, so a node never leases more jobs than it has browsers.
+        loops = [asyncio.create_task(node_worker(broker, n)) for n in range(BROWSER_POOL_SIZE)]
+        await asyncio.gather(*loops)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Worker node shutting down gracefully...")
+    finally:
+        for task in loops:
+            task.cancel()
+        await asyncio.gather(*loops, return_exceptions=True)
+        await broker.close()
+        if metrics_server:
+            metrics_server.close()
+        await session_manager.stop()
+        await profile_maintainer.stop()
+        await browser_pool.shutdown()
+
+
 # --- Main Bot Execution ---
 async def main() -> None:
     """Initializes and runs the bot."""
-    # Load credentials on startup
-    load_credentials()
+    if BOT_ROLE == "worker":
+        await run_worker_node()
+        return
+    frontend = BOT_ROLE == "frontend"
+
+    # Load accounts and cached reviews on startup
+    account_pool.load()
+    credit_store.open()
+    review_cache.load()
 
     if not TELEGRAM_BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN is missing. Please check your .env file.")
         return
 
-    # Use the 'async with' block for robust startup and shutdown
-    async with Application.builder().token(TELEGRAM_BOT_TOKEN).build() as application:
-        # --- Add Scheduler and Handlers ---
-        application.job_queue.run_daily(
-            reset_all_credits_daily,
-            time=dt_time(hour=0, minute=0, second=0),
-            job_kwargs={'misfire_grace_time': 3600}
-        )
-        logger.info("Daily credit reset job scheduled successfully.")
+    if UPDATE_MODE == "webhook" and not (WEBHOOK_URL and WEBHOOK_SECRET):
+        logger.error("UPDATE_MODE=webhook needs WEBHOOK_URL and WEBHOOK_SECRET. Please check your .env file.")
+        return
 
+    if frontend and not BROKER_TOKEN:
+        logger.error("BOT_ROLE=frontend needs BROKER_TOKEN. Please check your .env file.")
+        return
+
+    # Handlers run concurrently (up to CONCURRENT_UPDATES) instead of one update at a time;
+    # review work itself is still bounded by the review scheduler.
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .request(InstrumentedRequest(connection_pool_size=256))  # 256 matches the builder's default pool
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
 
+    # Use the 'async with' block for robust startup and shutdown
+    async with builder.build() as application:
+        # --- Add Handlers ---
+        # Credits are replenished lazily per user, so no midnight job is needed.
         application.add_handler(CommandHandler("start", start_command))
         application.add_handler(CommandHandler("setconfig", set_config_command))
         application.add_handler(CommandHandler("myid", my_id_command))
         application.add_handler(CommandHandler("setcredits", set_credits_command))
+        application.add_handler(CommandHandler("settier", set_tier_command))
+        application.add_handler(CommandHandler("screenshots", screenshots_command))
+        application.add_handler(CommandHandler("stats", stats_command))
         #application.add_handler(MessageHandler(filters.Entity(MessageEntity.URL), handle_game_link))
-        application.add_handler(MessageHandler(filters.Regex(r'chess\.com'), handle_game_link))
+        # Non-blocking: a review handler lives until its result is sent, and would otherwise
+        # hold one of the CONCURRENT_UPDATES slots that commands and other messages need.
+        application.add_handler(MessageHandler(
+            filters.Regex(r'chess\.com') | filters.Regex(PGN_MOVES_PATTERN) | filters.Document.FileExtension("pgn"),
+            admit_game_request,
+            block=False,
+        ))
         logger.info("Bot starting...")
+
+        review_scheduler.start()
+        outbox.start()
+        await recover_jobs(application.bot)
+        metrics_server = None
+        if METRICS_PORT:
+            metrics_server = await asyncio.start_server(serve_metrics, METRICS_LISTEN, METRICS_PORT)
+            logger.info(f"Prometheus metrics on http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+        broker_server = None
+        if frontend:
+            broker_server = await asyncio.start_server(serve_broker, BROKER_LISTEN, BROKER_PORT)
+            logger.info(f"Job broker for worker nodes on {BROKER_LISTEN}:{BROKER_PORT}")
+        else:
+            session_manager.start()
+            profile_maintainer.start()
         
         # This part runs the bot indefinitely until a shutdown signal is received
         # (like pressing Ctrl+C)
         try:
             await application.initialize()
             await application.start()
-            await application.updater.start_polling()
-            
+            if UPDATE_MODE == "webhook":
+                # Telegram pushes updates to a local HTTP server; requests without the
+                # matching secret token header are rejected before reaching any handler.
+                await application.updater.start_webhook(
+                    listen=WEBHOOK_LISTEN,
+                    port=WEBHOOK_PORT,
+                    url_path=WEBHOOK_PATH,
+                    webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                    secret_token=WEBHOOK_SECRET,
+                    max_connections=WEBHOOK_MAX_CONNECTIONS,
+                )
+                logger.info(f"Receiving updates by webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+            else:
+                await application.updater.start_polling()
+                logger.info("Receiving updates by long polling.")
+
+            if ENGINE_PATH:
+                try:
+                    await engine_pool.start()
+                except Exception as e:
+                    logger.error(f"❌ UCI engine '{ENGINE_PATH}' could not be started, PGN analysis is disabled: {e}")
+
+            # Load Selenium, resolve the driver and warm the browsers only once polling is up,
+            # so /start and /myid answer right away. Any failure here stops the bot with a clear error.
+            # A front-end has no browsers; its reviews run on worker nodes.
+            if not frontend:
+                try:
+                    await prepare_browser_tier()
+                except RuntimeError as e:
+                    logger.critical(f"❌ Browser stack could not be prepared: {e}")
+                    return
+
             # Keep the application running
             while True:
                 await asyncio.sleep(3600) # Sleep for a long time
@@ -578,6 +3865,17 @@ async def main() -> None:
                 await application.updater.stop()
             if application.running:
                 await application.stop()
+            await review_scheduler.stop()
+            await outbox.stop()
+            if metrics_server:
+                metrics_server.close()
+            if broker_server:
+                broker_server.close()
+            await session_manager.stop()
+            await profile_maintainer.stop()
+            await browser_pool.shutdown()
+            await engine_pool.shutdown()
+            credit_store.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,67 @@
+"""
+Minimal UCI engine for running the PGN analysis backend without a real engine,
+e.g. ENGINE_PATH="python stub_engine.py". It answers instantly, scores positions
+by material and suggests the move that wins the most material right away.
+"""
+import sys
+
+import chess
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+def material(board: chess.Board) -> int:
+    """Material balance in centipawns from the side to move's point of view."""
+    score = 0
+    for piece in board.piece_map().values():
+        value = PIECE_VALUES[piece.piece_type]
+        score += value if piece.color == board.turn else -value
+    return score
+
+def best_move(board: chess.Board):
+    def gain(move):
+        board.push(move)
+        value = -material(board)
+        board.pop()
+        return value
+    return max(board.legal_moves, key=gain, default=None)
+
+def set_position(args: list) -> chess.Board:
+    if args[0] == "startpos":
+        board, rest = chess.Board(), args[1:]
+    else:
+        board, rest = chess.Board(" ".join(args[1:7])), args[7:]
+    for uci in rest[1:] if rest[:1] == ["moves"] else []:
+        board.push_uci(uci)
+    return board
+
+def main():
+    board = chess.Board()
+    for line in sys.stdin:
+        command, *args = line.split() or [""]
+        if command == "uci":
+            print("id name StubEngine")
+            print("uciok")
+        elif command == "isready":
+            print("readyok")
+        elif command == "ucinewgame":
+            board = chess.Board()
+        elif command == "position":
+            board = set_position(args)
+        elif command == "go":
+            move = best_move(board)
+            if move is None:
+                print("info depth 0 score cp 0")
+                print("bestmove 0000")
+            else:
+                board.push(move)
+                score = -material(board)
+                board.pop()
+                print(f"info depth 1 score cp {score} pv {move.uci()}")
+                print(f"bestmove {move.uci()}")
+        elif command == "quit":
+            break
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()